@@ -0,0 +1,385 @@
+"""
+Benchmarks for the hierarchical clustering pipeline.
+
+Usage: python -m TD.benchmark [name ...]
+(with no name, all the benchmarks are run)
+"""
+
+from TD.cloud import Point, Cloud, load_cloud_from_file, save_cloud, open_cloud
+from TD.graph import Graph, ArrayGraph, Edge, graph_from_cloud, graph_from_matrix, graph_from_matrix_file
+from TD.graph import read_matrix_file, convert_matrix_file
+from TD.dendrogram import Dendrogram
+from TD.distance import condensed_distances
+from TD.external import external_dendrogram_from_cloud
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+
+
+def random_cloud(n: int, d: int = 2, seed: int = 0) -> Cloud:
+    """A cloud of n points drawn around a few Gaussian centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(0, 10, size=(8, d))
+    coords = centres[rng.integers(0, 8, size=n)] + rng.normal(size=(n, d))
+    return Cloud.from_coords(coords, [str(i) for i in range(n)])
+
+
+def iris_cloud() -> Cloud:
+    with open('csv/iris.csv', 'r') as infile:
+        return load_cloud_from_file(infile)
+
+
+def timed(f, *args, **kwargs):
+    """Return (f(*args, **kwargs), elapsed seconds)."""
+    start = time.perf_counter()
+    res = f(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+
+def report(label: str, seconds: float, reference: float = None) -> None:
+    s = f'  {label:<40} {seconds:10.4f} s'
+    if reference is not None and seconds > 0:
+        s += f'  (x{reference / seconds:.1f})'
+    print(s)
+
+
+# Reference implementations (the original, pure Python versions)
+
+def graph_from_cloud_reference(c: Cloud) -> Graph:
+    res = Graph()
+    for i in range(len(c)):
+        for j in range(i):
+            p1 = c[i]
+            p2 = c[j]
+            e = Edge(i, j, p1.dist(p2))
+            res.add_edges([e])
+        res.add_nodes([c[i].name])
+    return res
+
+
+def load_cloud_reference(infile) -> Cloud:
+    c = Cloud()
+    _ = infile.readline()
+    for line in infile:
+        parts = line.split(',')
+        c.add_point(Point([float(x) for x in parts[:-1]], parts[-1].strip()))
+    return c
+
+
+def read_matrix_file_reference(filename):
+    node_names = []
+    dist_matrix = []
+    with open(filename, 'r') as f:
+        n = int(f.readline())
+        for _ in range(n):
+            node_names.append(f.readline().strip())
+        for _ in range(n):
+            dist_matrix.append([float(x) for x in f.readline().strip().split(',')])
+    return node_names, dist_matrix
+
+
+class GraphReference(Graph):
+    """Graph re-sorting all its edges on each add_edges."""
+
+    def add_edges(self, es: [Edge]) -> None:
+        self.edges.extend(es)
+        self.edges.sort()
+
+
+class DendrogramReference(Dendrogram):
+    """Dendrogram with the recursive, uncompressed find of build()."""
+
+    def find_rep(self, i: int) -> int:
+        if self.parent[i] == -1:
+            return i
+        return self.find_rep(self.parent[i])
+
+    def build(self):
+        i = 0
+        n = self.get_n()
+        for e in self.g.edges:
+            if self.find_rep(e.p1) != self.find_rep(e.p2):
+                self.merge(e)
+                i += 1
+            if i == n - 1:
+                break
+
+
+def set_clusters_reference(d: Dendrogram, h: float) -> None:
+    """The original recursive cluster assignment."""
+    def rec(i):
+        if d.parent[i] == -1 or d.height[i] > h:
+            d.cluster[i] = i
+        else:
+            d.cluster[i] = d.cluster[d.parent[i]]
+        if d.left[i] != -1:
+            rec(d.left[i])
+        if d.down[i] != -1:
+            rec(d.down[i])
+    rec(d.find_rep(0))
+
+
+def find_heights_reference(d: Dendrogram, eps: float) -> [float]:
+    """The original bucket loop over 1/eps Python slots."""
+    h = d.get_dendrogram_height()
+    buckets = [0.0] * int(1 / eps + 1)
+    for h_i in d.height:
+        if h_i != -1:
+            q = int(h_i / eps / h)
+            buckets[q] = max(buckets[q], h_i)
+    return [x for x in buckets if x > 0]
+
+
+def build_dendrogram(cls, g: Graph) -> Dendrogram:
+    d = cls(g)
+    d.build()
+    return d
+
+
+# Benchmarks
+
+def bench_graph_from_cloud():
+    print('graph_from_cloud')
+    clouds = [('iris', iris_cloud())]
+    clouds += [(f'random n={n}', random_cloud(n, 4)) for n in (1000, 3000)]
+    for label, c in clouds:
+        print(f' {label} ({len(c)} points)')
+        g, t = timed(graph_from_cloud, c)
+        if len(c) <= 200:
+            g_ref, t_ref = timed(graph_from_cloud_reference, c)
+            assert [(e.p1, e.p2) for e in g.edges] == [(e.p1, e.p2) for e in g_ref.edges]
+            report('reference (pairwise loop)', t_ref)
+            report('vectorized', t, t_ref)
+        else:
+            report('vectorized', t)
+        g_compact, t = timed(graph_from_cloud, c, compact=True)
+        report('vectorized, compact', t)
+        if len(c) > 200:
+            D, t_ref = timed(condensed_distances, c.coords)
+            report('distances only', t_ref)
+            D_par, t = timed(condensed_distances, c.coords, workers=0)
+            assert np.array_equal(D, D_par)
+            report(f'distances only, {os.cpu_count()} processes', t, t_ref)
+        for lbl, h in (('', g), (', compact', g_compact)):
+            size = sum(a.nbytes for a in h.edge_arrays())
+            print(f'  {"edge arrays" + lbl:<40} {size / 2**20:10.1f} MiB')
+
+
+def bench_add_edges():
+    print('add_edges (500 batches of 50 edges)')
+    rng = np.random.default_rng(0)
+    batches = [[Edge(int(i), int(j), float(l)) for (i, j, l)
+                in zip(rng.integers(0, 1000, 50), rng.integers(0, 1000, 50), rng.random(50))]
+               for _ in range(500)]
+
+    def feed(g, add):
+        for es in batches:
+            getattr(g, add)(es)
+        return g.edge_count()
+
+    _, t_ref = timed(feed, GraphReference(), 'add_edges')
+    report('reference (extend + sort)', t_ref)
+    for cls in (Graph, ArrayGraph):
+        for add in ('add_edges', 'bulk_add_edges'):
+            _, t = timed(feed, cls(), add)
+            report(f'{cls.__name__}.{add}', t, t_ref)
+
+
+def bench_build():
+    print('Dendrogram.build')
+    for label, c in (('iris', iris_cloud()), ('random n=5000', random_cloud(5000, 4))):
+        print(f' {label} ({len(c)} points)')
+        g = graph_from_cloud(c)
+        d_ref, t_ref = timed(build_dendrogram, DendrogramReference, g)
+        report('reference (recursive find, Edge objects)', t_ref)
+        d, t = timed(build_dendrogram, Dendrogram, g)
+        report('path compression, edge arrays', t, t_ref)
+        assert d.height == d_ref.height
+
+
+def bench_mst(methods=('kruskal', 'lazy', 'prim', 'boruvka', 'parallel'), sizes=(1000, 5000, 20000)):
+    print('Dendrogram.from_cloud')
+    for n in sizes:
+        c = random_cloud(n, 2)
+        print(f' random n={n}, d=2')
+        heights = None
+        t_ref = None
+        for method in methods:
+            if method in ('kruskal', 'lazy') and n > 5000:
+                continue
+            d, t = timed(Dendrogram.from_cloud, c, method=method)
+            report(method, t, t_ref)
+            if heights is None:
+                heights, t_ref = sorted(d.height), t
+            else:
+                assert sorted(d.height) == heights, method
+
+
+def bench_cut():
+    print('set_clusters at every significant height (eps = 0.01)')
+    sys.setrecursionlimit(100000)  # For the recursive reference
+    for label, c in (('iris', iris_cloud()), ('random n=20000', random_cloud(20000, 2))):
+        d = Dendrogram.from_cloud(c, method='boruvka')
+        d.find_heights(0.01)
+        hs = d.significant_heights
+        print(f' {label} ({len(c)} points, {len(hs)} heights)')
+
+        def cut_all(set_clusters):
+            res = []
+            for h in hs:
+                d.clear_clusters()
+                set_clusters(d, h)
+                res.append(list(d.cluster))
+            return res
+
+        ref, t_ref = timed(cut_all, set_clusters_reference)
+        report('reference (recursive)', t_ref)
+        res, t = timed(cut_all, Dendrogram.set_clusters)
+        report('by tree levels', t, t_ref)
+        assert res == ref
+        (labels, _, _), t = timed(d.cut_many, hs)
+        report('cut_many', t, t_ref)
+        assert labels.tolist() == ref
+        epsilons = [10.0**-e for e in range(1, 7)]
+        ref, t_ref = timed(lambda: [find_heights_reference(d, eps) for eps in epsilons])
+        report('find_heights x6 (reference loop)', t_ref)
+
+        def find_all():
+            res = []
+            for eps in epsilons:
+                d.find_heights(eps)
+                res.append(d.significant_heights)
+            return res
+        res, t = timed(find_all)
+        report('find_heights x6 (eps = 1e-1..1e-6)', t, t_ref)
+        assert res == ref
+
+
+def write_iris_like(filename: str, n: int, seed: int = 0) -> None:
+    """Write n random rows shaped like csv/iris.csv."""
+    rng = np.random.default_rng(seed)
+    species = np.array(['Iris-setosa', 'Iris-versicolor', 'Iris-virginica'])
+    with open(filename, 'w') as f:
+        f.write('a,b,c,d,name\n')
+        for start in range(0, n, 100000):
+            m = min(100000, n - start)
+            coords = np.round(rng.uniform(0, 8, size=(m, 4)), 1)
+            names = species[rng.integers(0, 3, size=m)]
+            f.writelines(f'{a},{b},{c},{d},{s}\n' for (a, b, c, d), s in zip(coords.tolist(), names))
+
+
+def bench_load(n=500000):
+    print(f'load_cloud_from_file ({n} rows shaped like csv/iris.csv)')
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'cloud.csv')
+        write_iris_like(filename, n)
+        with open(filename) as infile:
+            c_ref, t_ref = timed(load_cloud_reference, infile)
+        report('reference (line by line)', t_ref)
+        with open(filename) as infile:
+            c, t = timed(load_cloud_from_file, infile)
+        report('chunked np.loadtxt', t, t_ref)
+        assert np.array_equal(c.coords, c_ref.coords) and c.names == c_ref.names
+        with open(filename) as infile:
+            _, t = timed(load_cloud_from_file, infile, dtype=np.float32)
+        report('chunked np.loadtxt, float32', t, t_ref)
+        binary = os.path.join(tmp, 'cloud.bin')
+        _, t = timed(save_cloud, c, binary)
+        report('save_cloud', t)
+        c_bin, t = timed(open_cloud, binary)
+        report('open_cloud (memory-mapped)', t, t_ref)
+        assert np.array_equal(c_bin.coords, c.coords)
+
+
+def write_matrix_file(filename: str, c: Cloud) -> None:
+    """Write the distance matrix of c in the format of csv/languages.csv."""
+    X = c.coords
+    with open(filename, 'w') as f:
+        f.write(f'{len(c)}\n')
+        f.writelines(f'{name}\n' for name in c.names)
+        for i in range(len(c)):
+            row = np.round(np.sqrt(np.sum((X - X[i])**2, axis=1)), 3)
+            f.write(','.join(map(str, row.tolist())) + '\n')
+
+
+def bench_matrix(n=2000):
+    print(f'graph_from_matrix_file ({n} x {n} matrix)')
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'matrix.csv')
+        write_matrix_file(filename, random_cloud(n, 4))
+        (names, matrix), t_ref = timed(read_matrix_file_reference, filename)
+        report('reference parse (full rows)', t_ref)
+        _, t = timed(read_matrix_file, filename)
+        report('lower-triangle parse', t, t_ref)
+        binary = os.path.join(tmp, 'matrix.bin')
+        convert_matrix_file(filename, binary)
+        g_ref, t_ref = timed(graph_from_matrix, names, matrix)
+        report('graph_from_matrix (parsed lists)', t_ref)
+        g, t = timed(graph_from_matrix_file, filename)
+        report('graph_from_matrix_file, text', t, t_ref)
+        g_bin, t = timed(graph_from_matrix_file, binary)
+        report('graph_from_matrix_file, binary', t, t_ref)
+        assert np.array_equal(g.length, g_bin.length) and np.array_equal(g.p1, g_ref.p1)
+
+
+def bench_external(n=4000, budgets=(1 << 30, 16 << 20, 1 << 20)):
+    print(f'out-of-core Kruskal (random n={n}, {n * (n - 1) // 2} edges)')
+    c = random_cloud(n, 4)
+    d_ref, t_ref = timed(Dendrogram.from_cloud, c, method='kruskal')
+    report('in memory (graph_from_cloud, build)', t_ref)
+    for budget in budgets:
+        d, t = timed(external_dendrogram_from_cloud, c, budget)
+        report(f'external, {budget / 2**20:g} MiB budget', t, t_ref)
+        assert d.height == d_ref.height
+
+
+def bench_stream(n=100000, updates=5):
+    print(f'sliding window of {n} points (random, d=2, mean of {updates} updates)')
+    rng = np.random.default_rng(0)
+    d, t = timed(Dendrogram.from_cloud, random_cloud(n, 2), method='boruvka')
+    report('initial build (boruvka)', t)
+    d.window = n
+    times = [timed(d.insert_point, Point(rng.random(2)))[1] for _ in range(updates)]
+    report('insert_point, evicting the oldest', sum(times) / updates, t)
+    times = [timed(d.remove_point, int(rng.integers(len(d.cloud))))[1] for _ in range(updates)]
+    report('remove_point at random', sum(times) / updates, t)
+
+
+def bench_knn(sizes=(2000, 5000, 20000), d=32):
+    print(f'Dendrogram.from_cloud, approximate k-NN graph against the exact tree (d={d})')
+    for n in sizes:
+        c = random_cloud(n, d)
+        print(f' random n={n}, d={d}')
+        exact, t_ref = timed(Dendrogram.from_cloud, c, method='prim')
+        report('prim (exact)', t_ref)
+        approx, t = timed(Dendrogram.from_cloud, c, method='knn')
+        report('knn', t, t_ref)
+        h_ref, h = np.sort(exact.height), np.sort(approx.height)
+        merged = h_ref > 0
+        error = h[merged] / h_ref[merged] - 1
+        print(f'  height error (by rank): max {error.max():.2%}, mean {error.mean():.3%}, '
+              f'exact {np.mean(h == h_ref):.1%}')
+
+
+BENCHMARKS = {
+    'graph': bench_graph_from_cloud,
+    'add_edges': bench_add_edges,
+    'build': bench_build,
+    'mst': bench_mst,
+    'cut': bench_cut,
+    'load': bench_load,
+    'matrix': bench_matrix,
+    'external': bench_external,
+    'stream': bench_stream,
+    'knn': bench_knn,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f'Unknown benchmark {name}; available: {" ".join(BENCHMARKS)}')
+            exit(1)
+        BENCHMARKS[name]()
@@ -1,6 +1,10 @@
 # module cloud
 """Minimal implementation of data points and clouds."""
 
+import itertools
+import os
+import struct
+import sys
 import numpy as np
 
 class Point:
@@ -15,10 +19,20 @@ class Point:
         name: str = ''
     """
 
+    __slots__ = ('coords', 'name')
+
     def __init__(self, coords : list[float], name=''):  #A priori Python privilégie l'utilisation de list[type] plutot que [type] (type[] en Java)
         self.coords = np.array(coords)
         self.name = name
 
+    @classmethod
+    def view(cls, coords: np.ndarray, name=''):
+        """A Point sharing (instead of copying) the given coords array."""
+        p = cls.__new__(cls)
+        p.coords = coords
+        p.name = name
+        return p
+
     def __str__(self):
         return f'{self.coords} ({self.name})'
 
@@ -37,45 +51,299 @@ class Point:
 class Cloud:
     """
     A very minimalistic cloud of points.
+
+    The coordinates are stored row by row in a single (n, d) array,
+    grown geometrically as points are added, and the names in a
+    parallel list.  Indexing or iterating over the cloud yields Points
+    whose coords are views on the rows of that array (views obtained
+    before the storage grows keep pointing to the old block).
+
+    Attributes
+    ----------
+    coords : np.ndarray -- (n, d) view on the coordinates of all points
+    names : [str] -- the names of the points
     """
-    def __init__(self):
-        self._points = []
+    def __init__(self, dtype=np.float64, capacity: int = 0):
+        self._dtype = np.dtype(dtype)
+        self._capacity = capacity
+        self._coords = None  # (capacity, d) block, allocated with the first point
+        self._names = []
+        self._n = 0
+
+    @classmethod
+    def from_coords(cls, coords, names=None):
+        """A cloud wrapping the (n, d) array coords (not copied when
+        it already is a contiguous array of floats; other types are
+        converted to float64)."""
+        coords = np.asarray(coords)
+        coords = np.ascontiguousarray(coords, dtype=coords.dtype if coords.dtype.kind == 'f' else np.float64)
+        if coords.ndim != 2:
+            raise ValueError(f'coords should be an (n, d) array, not {coords.shape}')
+        c = cls(dtype=coords.dtype)
+        c._coords = coords
+        c._n = c._capacity = coords.shape[0]
+        c._names = [''] * c._n if names is None else list(names)
+        if len(c._names) != c._n:
+            raise ValueError(f'{len(c._names)} names for {c._n} points')
+        return c
 
     def __str__(self) -> str:
         top = f'Cloud:\n'
-        index_width = len(str(len(self._points) - 1))  # Width of max index
+        index_width = len(str(len(self) - 1))  # Width of max index
         rest = ''.join(f' {i:>{index_width}} {p}\n'
-                       for (i, p) in enumerate(self._points))
+                       for (i, p) in enumerate(self))
         return top + rest
 
     def __len__(self) -> int:
-        return len(self._points)
+        return self._n
 
     def __iter__(self):
         '''
-        the __iter__ method returns an iterator (created by the built-in iter function) over the internal list of points. This allows us to iterate directly over the points in the cloud.
+        the __iter__ method returns an iterator over the points of the cloud. This allows us to iterate directly over the points in the cloud.
         for p in c:
         for (i, p_i) in enumerate(c):
         sont désormais possibles
         '''
-        return iter(self._points)
+        for i in range(self._n):
+            yield Point.view(self._coords[i], self._names[i])
 
     def __getitem__(self, i : int):
         '''This allows objects to support indexing (e.g., obj[index])'''
-        return self._points[i]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError('Cloud index out of range')
+        return Point.view(self._coords[i], self._names[i])
+
+    @property
+    def coords(self) -> np.ndarray:
+        """The (n, d) array of coordinates (a view, not a copy)."""
+        if self._coords is None:
+            return np.empty((0, 0), dtype=self._dtype)
+        return self._coords[:self._n]
+
+    @property
+    def names(self) -> [str]:
+        return self._names
+
+    def dimension(self) -> int:
+        return 0 if self._coords is None else self._coords.shape[1]
+
+    def _reserve(self, n: int, d: int) -> None:
+        """Make room for n points of dimension d."""
+        if not isinstance(self._names, list):  # Names of an opened binary cloud
+            self._names = list(self._names)
+        if self._coords is None:
+            self._coords = np.empty((max(n, self._capacity), d), dtype=self._dtype)
+        elif self._coords.shape[1] != d:
+            raise ValueError(f'Point of dimension {d} added to a cloud of dimension {self._coords.shape[1]}')
+        elif n > self._coords.shape[0]:
+            block = np.empty((max(n, 2 * self._coords.shape[0]), d), dtype=self._dtype)
+            block[:self._n] = self._coords[:self._n]
+            self._coords = block
+        self._capacity = self._coords.shape[0]
 
     def add_point(self, p : Point) -> None:
-        self._points.append(p)
-
-
-def load_cloud_from_file(infile):
-    """Load a point cloud from a file object (already opened for reading."""
-    c = Cloud()
-    _ = infile.readline()  # Throw away header
-    for line in infile:
-        parts = line.split(',')
-        coords = [float(x) for x in parts[:-1]]
-        name = parts[-1].strip()
-        c.add_point(Point(coords, name))
+        row = np.ravel(p.coords)
+        self._reserve(self._n + 1, row.shape[0])
+        self._coords[self._n] = row
+        self._names.append(p.name)
+        self._n += 1
+
+    def add_points(self, coords, names=None) -> None:
+        """Append the rows of the (m, d) array coords as new points."""
+        coords = np.asarray(coords)
+        m = coords.shape[0]
+        if names is None:
+            names = [''] * m
+        elif len(names) != m:
+            raise ValueError(f'{len(names)} names for {m} points')
+        self._reserve(self._n + m, coords.shape[1])
+        self._coords[self._n:self._n + m] = coords
+        self._names.extend(names)
+        self._n += m
+
+    def remove_points(self, indices) -> None:
+        """Remove the points at the given indices; the following points
+        move down to fill the gaps, in order.  The kept points go to a
+        new block: the previous one may be the caller's array (see
+        from_coords) or a mapped file, and earlier Points view it."""
+        keep = np.ones(self._n, dtype=bool)
+        keep[indices] = False
+        m = int(np.count_nonzero(keep))
+        if self._coords is not None:
+            block = np.empty((max(m, self._capacity), self._coords.shape[1]), dtype=self._dtype)
+            block[:m] = self.coords[keep]
+            self._coords = block
+        self._names = [name for name, k in zip(self._names, keep.tolist()) if k]
+        self._n = m
+
+
+def load_cloud_from_file(infile, usecols=None, dtype=np.float64, max_rows=None,
+                         chunk_rows: int = 1 << 16):
+    """Load a point cloud from a file object (already opened for reading.
+
+    After a header line, each line holds the coordinates then the name
+    of a point, comma-separated.  The lines are parsed chunk_rows at a
+    time by np.loadtxt and appended in bulk to the cloud.
+
+    usecols -- the (positions of the) coordinate columns to keep
+    dtype -- the type of the coordinates (e.g. np.float32)
+    max_rows -- the maximum number of points to read
+    """
+    header = infile.readline()  # Throw away header
+    if usecols is None:
+        usecols = range(header.count(','))
+    usecols = list(usecols)
+    c = Cloud(dtype=dtype)
+    while max_rows is None or len(c) < max_rows:
+        k = chunk_rows if max_rows is None else min(chunk_rows, max_rows - len(c))
+        chunk = list(itertools.islice(infile, k))
+        if not chunk:
+            break
+        lines = [line for line in chunk if line.strip()]
+        if not lines:
+            continue
+        coords = np.loadtxt(lines, delimiter=',', usecols=usecols, dtype=dtype, ndmin=2)
+        names = [line.rsplit(',', 1)[-1].strip() for line in lines]
+        if len(c) == 0 and max_rows is None:
+            c._reserve(_estimate_rows(infile, lines), coords.shape[1])
+        c.add_points(coords, names)
     return c
 
+
+def _estimate_rows(infile, lines: [str]) -> int:
+    """Estimate the number of lines of infile, from the size of the file
+    and the lines read so far, to allocate the cloud once.
+    """
+    try:
+        size = os.fstat(infile.fileno()).st_size
+    except (AttributeError, OSError, ValueError):  # Not a real file
+        return len(lines)
+    return int(1.02 * size * len(lines) / sum(len(line) for line in lines))
+
+
+# Binary format
+#
+# A cloud file is made of
+# - a 64-byte header: magic string, n, d, dtype of the coordinates (numpy
+#   type string, e.g. '<f8') and offset of the name table;
+# - the (n, d) coordinates, contiguous, starting at byte 64;
+# - the name table: n + 1 int64 offsets, then the UTF-8 encoded names
+#   (name i is made of the bytes offsets[i]..offsets[i+1]-1).
+# All integers are little-endian.
+
+_CLOUD_MAGIC = b'TDCLOUD1'
+_HEADER = struct.Struct('<8sQQ8sQ')
+_HEADER_SIZE = 64
+
+
+class NameTable:
+    """Read-only sequence of names stored as UTF-8 bytes data, name i
+    being data[offsets[i]:offsets[i+1]], decoded on access.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self._offsets = offsets
+        self._data = data
+
+    @classmethod
+    def from_file(cls, filename: str, offset: int, n: int):
+        """Memory-map the name table of n names at offset in the file."""
+        offsets = np.memmap(filename, dtype='<i8', mode='r', offset=offset, shape=(n + 1,))
+        size = int(offsets[-1])
+        start = offset + 8 * (n + 1)
+        data = (np.memmap(filename, dtype=np.uint8, mode='r', offset=start, shape=(size,))
+                if size > 0 else np.empty(0, dtype=np.uint8))
+        return cls(offsets, data)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('name index out of range')
+        return self._data[self._offsets[i]:self._offsets[i + 1]].tobytes().decode()
+
+    def __iter__(self):
+        data = self._data.tobytes()
+        offsets = self._offsets.tolist()
+        for a, b in zip(offsets, offsets[1:]):
+            yield data[a:b].decode()
+
+
+def encode_names(names):
+    """The (offsets, data) arrays of a name table."""
+    encoded = [name.encode() for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def write_name_table(f, names) -> None:
+    """Write the name table of names to the binary file f."""
+    for a in encode_names(names):
+        f.write(a.tobytes())
+
+
+def save_cloud(c: Cloud, filename: str) -> None:
+    """Save the cloud c in the binary format read by open_cloud."""
+    coords = c.coords
+    n, d = len(c), c.dimension()
+    dtype = coords.dtype.newbyteorder('<')
+    names_offset = _HEADER_SIZE + n * d * dtype.itemsize
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(_CLOUD_MAGIC, n, d, dtype.str.encode(), names_offset)
+                .ljust(_HEADER_SIZE, b'\0'))
+        np.ascontiguousarray(coords, dtype=dtype).tofile(f)
+        write_name_table(f, c.names)
+
+
+def is_cloud_file(filename: str) -> bool:
+    """Whether the named file is in the binary format of save_cloud."""
+    with open(filename, 'rb') as f:
+        return f.read(len(_CLOUD_MAGIC)) == _CLOUD_MAGIC
+
+
+def open_cloud(filename: str, mode: str = 'r') -> Cloud:
+    """Open a cloud saved by save_cloud without reading it: the
+    coordinates are memory-mapped (mode 'r' or 'r+' as for np.memmap)
+    and the names decoded when accessed.  Adding points to the cloud
+    copies it to memory.
+    """
+    with open(filename, 'rb') as f:
+        magic, n, d, dtype, names_offset = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _CLOUD_MAGIC:
+        raise ValueError(f'{filename} is not a cloud file')
+    dtype = np.dtype(dtype.rstrip(b'\0').decode())
+    c = Cloud(dtype=dtype)
+    if n * d > 0:
+        c._coords = np.memmap(filename, dtype=dtype, mode=mode, offset=_HEADER_SIZE, shape=(n, d))
+    elif d > 0:
+        c._coords = np.empty((0, d), dtype=dtype)
+    c._n = c._capacity = n
+    c._names = NameTable.from_file(filename, names_offset, n)
+    return c
+
+
+def convert_cloud_file(csv_filename: str, filename: str, **kwargs) -> Cloud:
+    """Convert a CSV cloud file (see load_cloud_from_file, which gets
+    the keyword arguments) to the binary format, and return the cloud.
+    """
+    with open(csv_filename, 'r') as infile:
+        c = load_cloud_from_file(infile, **kwargs)
+    save_cloud(c, filename)
+    return c
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(f'Usage: python -m TD.cloud <cloud.csv> <cloud.bin>')
+        print('Converts a CSV cloud to the binary format read by open_cloud.')
+        exit(1)
+    c = convert_cloud_file(sys.argv[1], sys.argv[2])
+    print(f'Converted {len(c)} points of dimension {c.dimension()} to {sys.argv[2]}')
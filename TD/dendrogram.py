@@ -2,16 +2,27 @@
 A basic dendrogram for single-linkage hierarchical clustering.
 """
 
-from TD.graph import Graph, Edge
+from TD.cloud import Point, Cloud, load_cloud_from_file, open_cloud, is_cloud_file, NameTable, encode_names
+from TD.graph import Graph, ArrayGraph, Edge, graph_from_cloud, graph_from_condensed, lazy_condensed_edges
+from TD.distance import condensed_distances
+from TD.mst import mst_graph, sorted_edges, boruvka_link
+from TD.linkage import nn_chain_linkage
+import bisect
+import hashlib
+import os
+import tempfile
+import zipfile
 import numpy as np
 
+_CHUNK = 1 << 16  # Number of edges converted to Python values at once in build
+
 class Dendrogram:
     """
     Attributes
     ----------
 
     g : Graph -- the underlying graph
-    parent : [int] -- parents for union-find
+    parent : [int] -- parents for union-find (the dendrogram tree)
     rank : [int] -- ranks for union-find
     left : [int] -- binary tree lefts
     down : [int] -- binary tree downs
@@ -22,13 +33,24 @@ class Dendrogram:
     total_clusters : int -- number of clusters currently identified
     ns_clusters : int -- number of non-singleton clusters
     significant_heights : [float] -- List of significant heights (Ex. 5)
+    cloud : Cloud -- the points of the nodes, for a dendrogram built by
+        from_cloud (None otherwise), to insert points (see insert_points)
+    window : int -- if not None, the number of points kept by
+        insert_points, which removes the oldest (first) ones
     """
 
     def __init__(self, g: Graph):
         self.g = g
-        n = g.node_count()
+        self.cloud = None
+        self.window = None
+        self._reset()
+
+    def _reset(self):
+        """Start over with the nodes of the graph, all unmerged."""
+        n = self.g.node_count()
 
         self.parent = [-1] * n
+        self._uf = [-1] * n  # parent, with path compression (see _find)
         self.rank = [0] * n
         self.left = [-1] * n
         self.down = [-1] * n
@@ -39,6 +61,141 @@ class Dendrogram:
         self.total_clusters = 0
         self.ns_clusters = 0
         self.significant_heights = []
+        self._mst = ([], [], [])  # p1, p2, length of the edges merged along
+        self._levels = None  # see _tree_levels
+        self._profile = None  # see _merge_profile
+        self._index = None  # see _cluster_index
+
+    @classmethod
+    def from_cloud(cls, c: Cloud, method: str = 'prim', workers: int = None,
+                   linkage: str = 'single'):
+        """The (built) single-linkage dendrogram of the cloud c, or for
+        another linkage see from_condensed (method is then ignored).
+
+        method is 'kruskal' to build over the complete graph of c (see
+        graph_from_cloud), 'lazy' to build over its edges sorted only up
+        to the last merge (see lazy_condensed_edges), or else the algorithm computing a minimum
+        spanning tree directly from the coordinates (see TD.mst), over
+        whose n-1 edges the dendrogram is built:
+        - 'prim': dense Prim, O(n^2) time and O(n) memory;
+        - 'boruvka': dual-tree Boruvka over a KD-tree, sub-quadratic
+          for low-dimensional clouds;
+        - 'parallel': Prim over pairs of blocks of points, in as many
+          processes as CPUs, then Kruskal over the union of the trees.
+        - 'knn': the approximate 10-nearest-neighbour graph, linked by
+          repair edges, for high-dimensional clouds (see TD.knn): the
+          heights are those of the exact tree up to the missed edges.
+        workers is the number of processes computing the distances of
+        the complete graph (see graph_from_cloud), or the trees of
+        'parallel' (see parallel_mst).
+        """
+        if linkage != 'single':
+            return cls.from_condensed(c.names, condensed_distances(c.coords, workers=workers), linkage)
+        if method == 'lazy':
+            g = Graph()
+            g.add_nodes(c.names)
+            d = cls(g)
+            d.build(lazy_condensed_edges(condensed_distances(c.coords, workers=workers), len(c)))
+        else:
+            g = graph_from_cloud(c, workers=workers) if method == 'kruskal' else mst_graph(c, method, workers)
+            d = cls(g)
+            d.build()
+        d.cloud = c
+        return d
+
+    @classmethod
+    def from_condensed(cls, node_names: [str], lengths, linkage: str = 'single'):
+        """The (built) dendrogram of the nodes with the given condensed
+        distances (see TD.distance), for the linkage 'single' (over the
+        complete graph, see graph_from_condensed), 'complete', 'average'
+        or 'ward' (see TD.linkage), the heights being half the linkage
+        distances in every case.
+        """
+        if linkage == 'single':
+            d = cls(graph_from_condensed(node_names, lengths))
+            d.build()
+            return d
+        return cls.from_linkage(nn_chain_linkage(lengths, linkage), node_names)
+
+    def save(self, filename: str) -> None:
+        """Save the tree (parent, rank, left, down, height) and the node
+        names to filename, in npz format.
+        """
+        offsets, data = encode_names(self.g.node_names)
+        with open(filename, 'wb') as f:
+            np.savez(f, parent=np.array(self.parent, dtype=np.int64),
+                     rank=np.array(self.rank, dtype=np.int64),
+                     left=np.array(self.left, dtype=np.int64),
+                     down=np.array(self.down, dtype=np.int64),
+                     height=np.array(self.height, dtype=np.float64),
+                     name_offsets=offsets, name_data=data)
+
+    @classmethod
+    def load(cls, filename: str):
+        """Load a dendrogram saved by save().  Its graph has the node
+        names (decoded on access) but no edges.
+        """
+        with np.load(filename) as data:
+            g = Graph()
+            g.node_names = NameTable(data['name_offsets'], data['name_data'])
+            d = cls(g)
+            d.parent = data['parent'].tolist()
+            d._uf = list(d.parent)
+            d.rank = data['rank'].tolist()
+            d.left = data['left'].tolist()
+            d.down = data['down'].tolist()
+            d.height = data['height'].tolist()
+        return d
+
+    def to_linkage(self) -> np.ndarray:
+        """The dendrogram as a SciPy linkage matrix Z: row k merges the
+        clusters Z[k, 0] and Z[k, 1] (the leaves being 0..n-1 and the
+        cluster made at row k being n + k) at distance Z[k, 2], giving a
+        cluster of Z[k, 3] leaves.  The distance of a merge is the length
+        of its edge, i.e. twice its height.
+        """
+        levels, parent, height = self._tree_levels()
+        n = self.get_n()
+        merged = np.flatnonzero(parent != -1)
+        if len(merged) != n - 1:
+            raise ValueError('the dendrogram does not span all its nodes')
+        depth = np.empty(n, dtype=np.int64)
+        for k, level in enumerate(levels):
+            depth[level] = k
+        # By height, and on ties the merges into a node before its own
+        merged = merged[np.lexsort((-depth[merged], height[merged]))]
+        Z = np.empty((n - 1, 4))
+        rep = list(range(n))  # union-find over the nodes
+        cluster_id = list(range(n))  # for the representatives
+        size = [1] * n
+        for k, (i, p) in enumerate(zip(merged.tolist(), parent[merged].tolist())):
+            while rep[i] != i:
+                rep[i] = i = rep[rep[i]]
+            while rep[p] != p:
+                rep[p] = p = rep[rep[p]]
+            a, b = cluster_id[i], cluster_id[p]
+            rep[i] = p
+            size[p] += size[i]
+            cluster_id[p] = n + k
+            Z[k] = (min(a, b), max(a, b), 2 * height[merged[k]], size[p])
+        return Z
+
+    @classmethod
+    def from_linkage(cls, Z, node_names: [str]):
+        """The dendrogram of the SciPy linkage matrix Z (see to_linkage)
+        over the given node names.
+        """
+        Z = np.asarray(Z, dtype=np.float64)
+        n = len(Z) + 1
+        g = Graph()
+        g.add_nodes(node_names)
+        assert g.node_count() == n, f'{g.node_count()} names for a linkage of {n} leaves'
+        d = cls(g)
+        leaf = list(range(n)) + [-1] * (n - 1)  # a leaf of each cluster
+        for k, (a, b, dist) in enumerate(Z[:, :3].tolist()):
+            d._merge(leaf[int(a)], leaf[int(b)], dist)
+            leaf[n + k] = leaf[int(a)]
+        return d
 
     def __str__(self):
         lines = ["node\tparent\trank\tleft\tdown\theight\tcluster"]
@@ -62,17 +219,38 @@ class Dendrogram:
         for the cluster containing node i.
         """
         assert 0 <= i < self.g.node_count() #On s'assure que l'indice est valide
-        if self.parent[i] == -1:
-            return i
-        return self.find_rep(self.parent[i])
+        while self.parent[i] != -1:
+            i = self.parent[i]
+        return i
+
+    def _find(self, i: int) -> int:
+        """Same as find_rep, compressing the path from i in _uf.
+
+        _uf has the same roots as parent, but the non-root nodes point
+        directly (or at least closer) to their root.
+        """
+        uf = self._uf
+        root = i
+        while uf[root] != -1:
+            root = uf[root]
+        while uf[i] != -1 and uf[i] != root:
+            uf[i], i = root, uf[i]
+        return root
 
     def merge(self, e: Edge):
         """Merge the clusters connected by the edge."""
+        self._merge(e.p1, e.p2, e.length)
+
+    def _merge(self, p1: int, p2: int, length: float):
         # TODO: Exercise 8
         # Plan:
         # 1. Find the representatives
-        rp_1 = self.find_rep(e.p1) #Est ce qu'il faut plutôt prendre la valeur de e.p1.name ?
-        rp_2 = self.find_rep(e.p2)
+        self._union(self._find(p1), self._find(p2), length)
+        for edges, x in zip(self._mst, (p1, p2, length)):
+            edges.append(x)
+
+    def _union(self, rp_1: int, rp_2: int, length: float):
+        """Merge the clusters of representatives rp_1 and rp_2."""
         # 2. Choose the highest
         pere, fils = 0,0
         if self.rank[rp_1] >= self.rank[rp_2]:  #Le inférieur ou égal est crucial
@@ -82,6 +260,8 @@ class Dendrogram:
         
         # 3. Adjust parent, left, and down
         self.parent[fils] = pere
+        self._uf[fils] = pere
+        self._levels = self._profile = self._index = None
         self.left[fils] = self.down[pere]
         self.down[pere] = fils
 
@@ -89,78 +269,337 @@ class Dendrogram:
         if self.rank[pere] == self.rank[fils]:
             self.rank[pere] += 1
         # 5. Update heights
-        self.height[fils] = e.length/2    #Maybe we need to divide by 2
+        self.height[fils] = length/2    #Maybe we need to divide by 2
 
-    def build(self):
+    def build(self, edges=None):
         """Merge along each edge in non-decreasing length order
         to build the dendrogram.
+
+        The edges are read from the arrays of the graph (see
+        Graph.edge_arrays) chunk by chunk, without creating Edge objects,
+        or else from edges, an iterable of (p1, p2, length) chunks of
+        arrays in that order (e.g. TD.external.sort_edge_chunks), which is
+        closed once the n-1 merges are done.
         """
         # TODO: Exercise 9
-        self.g.edges.sort() #tri des arètes
+        if edges is None:
+            arrays = self.g.edge_arrays()
+            edges = ([a[start:start + _CHUNK] for a in arrays]
+                     for start in range(0, len(arrays[2]), _CHUNK))
         i = 0
-        for e in self.g.edges: 
-            if self.find_rep(e.p1) != self.find_rep(e.p2):
-                #On merge les représentants des clusters
-                self.merge(e)
-                i += 1
-                #On merge les clusters
-            if i == self.get_n() - 1:
-                break
+        n = self.get_n()
+        find = self._find
+        mst_p1, mst_p2, mst_length = self._mst
+        try:
+            for p1, p2, length in edges:
+                for a, b, l in zip(p1.tolist(), p2.tolist(), length.tolist()):
+                    rp_a, rp_b = find(a), find(b)
+                    if rp_a != rp_b:
+                        #On merge les représentants des clusters
+                        self._union(rp_a, rp_b, l)
+                        mst_p1.append(a)
+                        mst_p2.append(b)
+                        mst_length.append(l)
+                        i += 1
+                        #On merge les clusters
+                    if i == n - 1:
+                        break
+                if i == n - 1:
+                    break
+        finally:
+            close = getattr(edges, 'close', None)
+            if close is not None:
+                close()
+        self._tree_levels()
+        self._merge_profile()
+
+    def mst_edges(self):
+        """The edges (p1, p2, length) along which the clusters were merged
+        (by build or merge), in that order: a minimum spanning tree of the
+        graph (or forest, if it is not connected) after build().
+        """
+        p1, p2, length = self._mst
+        return (np.array(p1, dtype=np.int64), np.array(p2, dtype=np.int64),
+                np.array(length, dtype=np.float64))
+
+    def insert_point(self, p: Point) -> None:
+        """Add the point p to the dendrogram (see insert_points)."""
+        self.insert_points(np.ravel(p.coords)[None, :], [p.name])
 
+    def insert_points(self, coords, names=None) -> None:
+        """Add the rows of the (m, d) array coords as new points (with
+        the given names), to the cloud and to the dendrogram of a cloud
+        (see from_cloud), and rebuild the dendrogram.  With a window,
+        the oldest points are then removed (see remove_points).
+
+        The minimum spanning tree of the new complete graph is within the
+        current tree and the edges from each new point to the points
+        before it: any other edge closes a cycle of no longer edges of the
+        current tree.  So only these O(mn) distances are computed, and the
+        dendrogram is rebuilt over n + m - 1 + O(mn) edges instead of the
+        O(n^2) of the complete graph.
+        """
+        if self.cloud is None:
+            raise ValueError('Points can only be inserted into the dendrogram of a cloud (see from_cloud)')
+        coords = np.asarray(coords)
+        names = [''] * len(coords) if names is None else list(names)
+        if len(names) != len(coords):
+            raise ValueError(f'{len(names)} names for {len(coords)} points')
+        edges = [self.mst_edges()]
+        if self.window is not None:
+            # The new points beyond the window would go right away
+            skip = max(0, len(coords) - self.window)
+            coords, names = coords[skip:], names[skip:]
+            evicted = len(self.cloud) + len(coords) - self.window
+            if evicted > 0:
+                edges = [self._mst_without(np.arange(evicted))]
+                self.cloud.remove_points(np.arange(evicted))
+        n = len(self.cloud)
+        self.cloud.add_points(coords, names)
+        X = self.cloud.coords
+        for i in range(n, len(self.cloud)):
+            edges.append((np.full(i, i), np.arange(i), np.sqrt(np.sum((X[i] - X[:i])**2, axis=1))))
+        self._rebuild(*(np.concatenate(a) for a in zip(*edges)))
+
+    def remove_point(self, i: int) -> None:
+        """Remove node i (see remove_points)."""
+        self.remove_points([i])
+
+    def remove_points(self, indices) -> None:
+        """Remove the points at the given indices from the cloud and from
+        the dendrogram of a cloud (see from_cloud); the following nodes
+        move down to fill the gaps.  The dendrogram is rebuilt over the
+        minimum spanning tree found by _mst_without.
+        """
+        if self.cloud is None:
+            raise ValueError('Points can only be removed from the dendrogram of a cloud (see from_cloud)')
+        edges = self._mst_without(indices)
+        self.cloud.remove_points(indices)
+        self._rebuild(*edges)
+
+    def _mst_without(self, indices):
+        """The edges (p1, p2, length) of a minimum spanning tree of the
+        points of the cloud but those at indices (renumbered), computed
+        from the current tree.  The cloud is not changed.
+
+        The edges of the current tree between remaining points stay in
+        the tree.  They make a forest, whose trees are joined by
+        dual-tree Boruvka rounds (see boruvka_link), so that the search
+        for the edges between them is bounded by the KD-tree.
+        """
+        n = len(self.cloud)
+        removed = np.zeros(n, dtype=bool)
+        removed[indices] = True
+        new_index = np.cumsum(~removed) - 1
+        p1, p2, length = self.mst_edges()
+        kept = ~(removed[p1] | removed[p2])
+        p1, p2, length = new_index[p1[kept]], new_index[p2[kept]], length[kept]
+        X = self.cloud.coords[~removed]
+        if len(p1) >= len(X) - 1:
+            return p1, p2, length
+        c1, c2, c_length = boruvka_link(X, p1, p2)
+        return np.concatenate((p1, c1)), np.concatenate((p2, c2)), np.concatenate((length, c_length))
 
+    def _rebuild(self, p1, p2, length) -> None:
+        """Rebuild the dendrogram of the cloud over the edges (p1, p2,
+        length), which hold a minimum spanning tree.  The graph keeps
+        only the edges of the tree.
+        """
+        g = ArrayGraph()
+        g.add_nodes(self.cloud.names)
+        g._set_edge_arrays(*sorted_edges(p1, p2, length))
+        self.g = g
+        self._reset()
+        self.build()
+        g._set_edge_arrays(*self.mst_edges())
 
     def find_heights(self, eps: float):
-        """Put all heights <= eps into list of significant heights."""
+        """Put all heights <= eps into list of significant heights.
+
+        The heights are grouped in buckets of width eps times the height
+        of the dendrogram, and the highest of each bucket is kept.  Only
+        the non-empty buckets are stored, so that the memory does not
+        depend on eps.
+        """
         assert eps != 0.0
         h: float = self.get_dendrogram_height()
-        slots = int(1 / eps + 1)
-        buckets = [0.0] * slots
-        for i, h_i in enumerate(self.height):
-            if h_i == -1:
-                continue
-            q = int(h_i / eps / h)
-            if h_i > buckets[q]:
-                buckets[q] = h_i
-        self.significant_heights = [x for x in buckets if x > 0]
-
-    def _set_clusters(self, i: int, h: float):
-        assert 0 <= i < self.get_n()
+        heights = np.asarray(self.height, dtype=np.float64)
+        heights = heights[heights > 0]  # Neither roots (-1) nor empty buckets (0)
+        with np.errstate(over='ignore'):
+            q = np.floor(heights / h / eps)  # Bucket keys stay in float64
+        if not np.isfinite(q).all():  # Buckets narrower than the float spacing
+            q = heights
+        buckets, bucket = np.unique(q, return_inverse=True)
+        highest = np.zeros(len(buckets))
+        np.maximum.at(highest, bucket, heights)
+        self.significant_heights = highest.tolist()
+
+    def largest_gaps(self, k: int) -> [float]:
+        """The k merge heights followed by the largest gaps before the
+        next merge, largest gap first: the cuts at these heights give the
+        k most persistent clusterings (the last merge, followed by no
+        other, is not a candidate).
+        """
+        heights = np.unique(self._merge_profile()[0])
+        gaps = np.diff(heights)
+        top = np.argsort(-gaps, kind='stable')[:k]
+        return heights[top].tolist()
+
+    def _tree_levels(self):
+        """The nodes of the tree grouped by depth (roots first), with
+        the parent and height arrays.  Computed once after build().
+        """
+        if self._levels is None:
+            parent = np.array(self.parent)
+            depth = np.zeros(len(parent), dtype=np.int64)
+            up = parent.copy()
+            below = np.flatnonzero(up != -1)
+            while len(below):
+                depth[below] += 1
+                up[below] = parent[up[below]]
+                below = below[up[below] != -1]
+            order = np.argsort(depth, kind='stable')
+            levels = np.split(order, np.cumsum(np.bincount(depth))[:-1])
+            self._levels = (levels, parent, np.array(self.height, dtype=np.float64))
+        return self._levels
+
+    def _merge_profile(self):
+        """The merge heights in non-decreasing order, and the number of
+        non-singleton clusters after each prefix of these merges.
+        Computed once after build().
+        """
+        if self._profile is None:
+            _, parent, height = self._tree_levels()
+            n = self.get_n()
+            merged = np.flatnonzero(parent != -1)
+            merged = merged[np.argsort(height[merged], kind='stable')]
+            # Replay the merges with a union-find over the clusters
+            rep = list(range(n))
+            size = [1] * n
+            ns = [0]
+            for i, p in zip(merged.tolist(), parent[merged].tolist()):
+                while rep[i] != i:
+                    i = rep[i]
+                while rep[p] != p:
+                    p = rep[p]
+                if size[i] > size[p]:
+                    i, p = p, i
+                rep[i] = p
+                # Two singletons make a new cluster, two clusters one less
+                ns.append(ns[-1] + (size[i] == 1) - (size[p] > 1))
+                size[p] += size[i]
+            self._profile = (height[merged].tolist(), ns)
+        return self._profile
+
+    def num_clusters_at(self, h: float) -> int:
+        """The number of clusters at cut height h."""
+        heights, _ = self._merge_profile()
+        return self.get_n() - bisect.bisect_right(heights, h)
+
+    def num_ns_clusters_at(self, h: float) -> int:
+        """The number of non-singleton clusters at cut height h."""
+        heights, ns = self._merge_profile()
+        return ns[bisect.bisect_right(heights, h)]
+
+    def _set_clusters(self, h: float):
         # TODO: Exercise 10
-        
-        #If it's the root
-        if self.parent[i] == -1:
-            self.cluster[i] = i
-            self.total_clusters += 1
-        elif self.height[i] > h:
-            self.cluster[i] = i
-            self.total_clusters += 1
-        else:
-            self.cluster[i] = self.cluster[self.parent[i]]
-            
-        if self.left[i] != -1:
-            self._set_clusters(self.left[i], h)
-        if self.down[i] != -1:
-            self._set_clusters(self.down[i], h)
-    
-    def set_clusters(self, h: float):
-        """(Re)set clusters with cut height h."""
-        if self.cut_height is h:
-            return  # Already done!  Do nothing.
-        self.cut_height = h
-        self._set_clusters(self.find_rep(0), h)
+        # A node is its own cluster if it is a root or above the cut,
+        # else it is in the cluster of its parent: one numpy operation
+        # per level of the tree.
+        levels, parent, height = self._tree_levels()
+        cluster = np.arange(self.get_n())
+        for level in levels[1:]:
+            cluster[level] = np.where(height[level] > h, level, cluster[parent[level]])
+        self.cluster = cluster.tolist()
+        self.total_clusters = self.num_clusters_at(h)
+        self.ns_clusters = self.num_ns_clusters_at(h)
+
+    def set_clusters(self, h: float, index: bool = False):
+        """(Re)set clusters with cut height h.
+
+        With index=True, also build the cluster membership index used by
+        get_members, cluster_size, get_cluster_height and print_clusters
+        (otherwise built on first use by the first two).
+        """
+        if self.cut_height is not h:
+            self.cut_height = h
+            self._index = None
+            self._set_clusters(h)
+        if index:
+            self._cluster_index()
+
+    def _cluster_index(self):
+        """CSR-style index of the current clusters: the members of
+        cluster c are members[offsets[c]:offsets[c + 1]], and heights[c]
+        is its height (-1 if c has no child in its cluster).
+        """
+        if self._index is None:
+            assert self.cut_height != -1, 'set_clusters has not been called'
+            _, parent, height = self._tree_levels()
+            n = self.get_n()
+            cluster = np.array(self.cluster)
+            offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(cluster, minlength=n), out=offsets[1:])
+            members = np.argsort(cluster, kind='stable')
+            # The height of a cluster is the highest merge of one of the
+            # children of its representative into it
+            heights = np.full(n, -1.0)
+            children = np.flatnonzero(cluster == parent)
+            np.maximum.at(heights, parent[children], height[children])
+            self._index = (offsets, members, heights)
+        return self._index
+
+    def get_members(self, cluster: int) -> np.ndarray:
+        """The nodes of the cluster c (empty if c is not a cluster)."""
+        offsets, members, _ = self._cluster_index()
+        return members[offsets[cluster]:offsets[cluster + 1]]
+
+    def cluster_size(self, cluster: int) -> int:
+        """The number of nodes of the cluster c (0 if not a cluster)."""
+        offsets, _, _ = self._cluster_index()
+        return int(offsets[cluster + 1] - offsets[cluster])
+
+    def cut_many(self, heights: [float]):
+        """Clusters at each of the given cut heights, computed in a
+        single sweep over the merges sorted by height.
+
+        Returns (labels, total, ns) where labels[k] (an array) is the
+        cluster list set_clusters(heights[k]) would give, and total[k]
+        and ns[k] the numbers of clusters and non-singleton clusters.
+        """
+        _, parent, height = self._tree_levels()
+        n = self.get_n()
+        hs = np.asarray(heights, dtype=np.float64)
+        merged = np.flatnonzero(parent != -1)
+        merged = merged[np.argsort(height[merged], kind='stable')]
+        merge_heights = height[merged]
+
+        labels = np.empty((len(hs), n), dtype=np.int64)
+        total = np.empty(len(hs), dtype=np.int64)
+        ns = np.empty(len(hs), dtype=np.int64)
+        up = np.arange(n)  # parent of the nodes merged below the cut, else self
+        done = 0
+        for k in np.argsort(hs, kind='stable'):
+            stop = np.searchsorted(merge_heights, hs[k], side='right')
+            up[merged[done:stop]] = parent[merged[done:stop]]
+            done = stop
+            root = up
+            while True:  # Pointer jumping
+                nxt = root[root]
+                if np.array_equal(nxt, root):
+                    break
+                root = nxt
+            labels[k] = root
+            total[k] = n - done
+            ns[k] = np.count_nonzero(np.bincount(root, minlength=n) > 1)
+        return labels, total, ns
 
     def _count_ns_clusters(self):
         """Count non-singleton clusters from scratch"""
-        count = 0
         # TODO: Exercise 11
-        tab = np.zeros(self.get_n())
-        for i in range(self.get_n()):
-            tab[self.cluster[i]] += 1
-        for i in range(self.get_n()):
-            if tab[i] > 1:
-                count += 1
-
-        return count
+        cluster = np.array(self.cluster)
+        sizes = np.bincount(cluster[cluster >= 0], minlength=self.get_n())
+        return int(np.count_nonzero(sizes > 1))
 
     def count_ns_clusters(self) -> int:
         """The number of non-singleton clusters."""
@@ -175,6 +614,7 @@ class Dendrogram:
         self.ns_clusters = 0
         self.total_clusters = 0
         self.cut_height = -1
+        self._index = None
 
     def get_cluster_height(self, cluster: int) -> float:
         """Compute the height of the cluster c.
@@ -183,6 +623,9 @@ class Dendrogram:
         """
         assert 0 <= cluster < self.get_n()
         # TODO: Exercise 12
+        if self._index is not None:
+            h = self._index[2][cluster]
+            return float(h) if h != -1 else 0
         if self.cluster[cluster] == cluster and self.down[cluster] == -1:   #une feuille
             return 0
         elif self.cluster[cluster] != cluster: #C'est pas le représentant
@@ -227,17 +670,53 @@ class Dendrogram:
 
     def print_clusters(self):
         """For testing: print all clusters."""
-        print_after = [-1] * self.get_n()
-        for i, c_i in enumerate(self.cluster):
-            if c_i != i:
-                print_after[i] = print_after[c_i]
-                print_after[c_i] = i
+        offsets, members, _ = self._cluster_index()
         for i, c_i in enumerate(self.cluster):
             if c_i == i:  # Cluster rep
                 print(
                     f'Cluster "{c_i}" (node: {i}; height: {self.get_cluster_height(i)})'
                 )
-                next_c = print_after[i]
-                while next_c != -1:
-                    print(self.get_name(next_c))
-                    next_c = print_after[next_c]
+                for j in reversed(members[offsets[i]:offsets[i + 1]].tolist()):
+                    if j != i:
+                        print(self.get_name(j))
+
+
+def dendrogram_from_file(filename: str, method: str = 'prim', cache_dir: str = None) -> Dendrogram:
+    """The single-linkage dendrogram (see Dendrogram.from_cloud) of the
+    cloud in filename, a CSV file or a binary cloud file (see
+    TD.cloud.save_cloud).
+
+    With a cache_dir, the dendrogram is saved there under a hash of the
+    contents of the file and of method, and loaded from there instead
+    of being rebuilt as long as the file does not change.  Entries are
+    written to a temporary file first, then renamed; an unreadable entry
+    is rebuilt.
+    """
+    if cache_dir is not None:
+        h = hashlib.sha256(method.encode())
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        cached = os.path.join(cache_dir, h.hexdigest() + '.npz')
+        if os.path.exists(cached):
+            try:
+                return Dendrogram.load(cached)
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                pass  # Damaged entry: rebuilt and replaced below
+    if is_cloud_file(filename):
+        c = open_cloud(filename)
+    else:
+        with open(filename, 'r') as infile:
+            c = load_cloud_from_file(infile)
+    d = Dendrogram.from_cloud(c, method)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        os.close(fd)
+        try:
+            d.save(tmp)
+            os.replace(tmp, cached)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    return d
@@ -0,0 +1,217 @@
+# module distance
+"""Pairwise Euclidean distances between the points of a cloud.
+
+Distances are stored in condensed form: the strict lower triangle of
+the distance matrix, row by row, so that the distance between points
+i and j < i is at index i(i-1)/2 + j.  This is the order in which
+graph_from_cloud enumerates the edges (1,0), (2,0), (2,1), (3,0), ...
+
+The tiles of a band of rows a..b-1 fill the condensed indices
+a(a-1)/2..b(b-1)/2-1, so that bands can be computed by separate
+processes writing into a shared (or memory-mapped) output.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def condensed_size(n: int) -> int:
+    """Number of pairs of n points."""
+    return n * (n - 1) // 2
+
+
+def condensed_to_pairs(k):
+    """The pairs (i, j), j < i, at the condensed indices k (arrays)."""
+    k = np.asarray(k, dtype=np.int64)
+    i = ((1 + np.sqrt(1 + 8 * k.astype(np.float64))) // 2).astype(np.int64)
+    # Fix the rounding errors of the square root, if any
+    i -= i * (i - 1) // 2 > k
+    i += i * (i + 1) // 2 <= k
+    return i, k - i * (i - 1) // 2
+
+
+def _block_size(d: int) -> int:
+    """Side of the square tiles, so that a tile holds about 1M floats."""
+    return max(16, int(np.sqrt(2**20 / max(d, 1))))
+
+
+def _fill_tile(X: np.ndarray, out: np.ndarray, a: int, b: int, c0: int, c1: int,
+               offset: int = 0) -> None:
+    """Write the distances between rows a..b-1 and columns c0..c1-1
+    (below the diagonal) of X into the condensed array out, which starts
+    at the condensed index offset.
+    """
+    # Same arithmetic as Point.dist, so that the results are identical.
+    D = np.sqrt(np.sum((X[a:b, None, :] - X[None, c0:c1, :])**2, axis=-1))
+    rows = np.arange(a, b)
+    cols = np.arange(c0, c1)
+    mask = cols[None, :] < rows[:, None]
+    idx = (rows * (rows - 1) // 2)[:, None] + cols[None, :]
+    out[idx[mask] - offset] = D[mask]
+
+
+def _fill_band(X: np.ndarray, out: np.ndarray, a: int, b: int, block_size: int,
+               offset: int = 0) -> None:
+    """Fill the tiles of the rows a..b-1."""
+    for c0 in range(0, b - 1, block_size):
+        _fill_tile(X, out, a, b, c0, min(c0 + block_size, b), offset)
+
+
+def band_distances(coords, a: int, b: int, block_size: int = None, out=None,
+                   dtype=np.float64) -> np.ndarray:
+    """The distances between the rows a..b-1 of coords and the rows
+    before them: the slice condensed_size(a):condensed_size(b) of
+    condensed_distances(coords), computed tile by tile.
+    """
+    X = np.asarray(coords)
+    if block_size is None:
+        block_size = _block_size(X.shape[1] if X.ndim == 2 else 1)
+    start = condensed_size(a)
+    if out is None:
+        out = np.empty(condensed_size(b) - start, dtype=dtype)
+    _fill_band(X, out, a, b, block_size, start)
+    return out
+
+
+def condensed_distances(coords, block_size: int = None, out=None, dtype=np.float64,
+                        workers: int = None) -> np.ndarray:
+    """Condensed array of the Euclidean distances between the rows of
+    the (n, d) array coords, computed tile by tile.
+
+    With workers > 1 (0 for all the CPUs), the bands of tiles are
+    computed by that many processes (see parallel_condensed_distances).
+    """
+    X = np.asarray(coords)
+    n = X.shape[0]
+    if block_size is None:
+        block_size = _block_size(X.shape[1] if X.ndim == 2 else 1)
+    if workers is not None and worker_count(workers) > 1 and n > block_size:
+        return parallel_condensed_distances(X, block_size, out, dtype, workers)
+    if out is None:
+        out = np.empty(condensed_size(n), dtype=dtype)
+    for a in range(0, n, block_size):
+        _fill_band(X, out, a, min(a + block_size, n), block_size)
+    return out
+
+
+# Parallel computation
+#
+# The coordinates are copied once to shared memory, which the worker
+# processes attach to when they start.  The output is either shared
+# memory as well (copied to an ordinary array at the end), or the file
+# of the np.memmap given as out, which each worker maps again.
+
+_worker_arrays = {}  # In a worker process: name -> (array, handle)
+
+
+def worker_count(workers: int) -> int:
+    """The number of processes meant by workers (0 for all the CPUs)."""
+    return (os.cpu_count() or 1) if workers == 0 else workers
+
+
+def _shared_array(shape, dtype):
+    """A new array in shared memory, with its SharedMemory handle."""
+    dtype = np.dtype(dtype)
+    size = max(1, int(np.prod(shape)) * dtype.itemsize)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def _array_spec(a: np.ndarray, shm) -> tuple:
+    """What a worker needs to map the array a again."""
+    if shm is not None:
+        return 'shm', shm.name, a.shape, a.dtype.str, 0
+    return 'file', a.filename, a.shape, a.dtype.str, a.offset
+
+
+def _attach(spec: tuple):
+    kind, name, shape, dtype, offset = spec
+    if kind == 'shm':
+        shm = shared_memory.SharedMemory(name=name)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+    return np.memmap(name, dtype=dtype, mode='r+', offset=offset, shape=shape), None
+
+
+def _init_worker(specs: dict) -> None:
+    for name, spec in specs.items():
+        _worker_arrays[name] = _attach(spec)
+
+
+def worker_array(name: str) -> np.ndarray:
+    """In a worker of shared_pool, the array shared under name."""
+    return _worker_arrays[name][0]
+
+
+@contextmanager
+def shared_pool(workers: int, arrays: dict, outputs: dict = None):
+    """A ProcessPoolExecutor of workers processes (0 for all the CPUs)
+    in which worker_array(name) is arrays[name], copied once to shared
+    memory (an np.memmap with a file is mapped again instead), or for
+    outputs[name] = (shape, dtype), a new shared array.
+
+    Yield the pool and the dict of the shared arrays, as seen by this
+    process; the shared memory is released on exit.
+    """
+    handles = []
+    shared = {}
+    specs = {}
+    try:
+        for name, a in arrays.items():
+            if isinstance(a, np.memmap) and a.filename is not None:
+                a.flush()
+                shared[name], shm = a, None
+            else:
+                shared[name], shm = _shared_array(a.shape, a.dtype)
+                handles.append(shm)
+                shared[name][...] = a
+            specs[name] = _array_spec(shared[name], shm)
+        for name, (shape, dtype) in (outputs or {}).items():
+            shared[name], shm = _shared_array(shape, dtype)
+            handles.append(shm)
+            specs[name] = _array_spec(shared[name], shm)
+        with ProcessPoolExecutor(worker_count(workers), initializer=_init_worker,
+                                 initargs=(specs,)) as pool:
+            yield pool, shared
+    finally:
+        shared.clear()  # Release the buffers before closing
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+
+def _worker_band(a: int, b: int, block_size: int) -> None:
+    out = worker_array('out')
+    _fill_band(worker_array('X'), out, a, b, block_size)
+    if isinstance(out, np.memmap):
+        out.flush()
+
+
+def parallel_condensed_distances(coords, block_size: int = None, out=None,
+                                 dtype=np.float64, workers: int = 0) -> np.ndarray:
+    """condensed_distances computed by a pool of workers processes (0
+    for all the CPUs), one band of rows per task.
+
+    If out is an np.memmap, the workers write directly to its file;
+    otherwise the result goes through shared memory.
+    """
+    X = np.asarray(coords)
+    n = X.shape[0]
+    if block_size is None:
+        block_size = _block_size(X.shape[1] if X.ndim == 2 else 1)
+    to_file = isinstance(out, np.memmap) and out.filename is not None
+    arrays = {'X': X, 'out': out} if to_file else {'X': X}
+    outputs = {} if to_file else {'out': ((condensed_size(n),), dtype if out is None else out.dtype)}
+    bands = [(a, min(a + block_size, n)) for a in range(0, n, block_size)]
+    with shared_pool(workers, arrays, outputs) as (pool, shared):
+        # The last bands are the longest: start them first.
+        for f in [pool.submit(_worker_band, a, b, block_size) for a, b in reversed(bands)]:
+            f.result()
+        if to_file:
+            return out
+        if out is None:
+            return shared['out'].copy()
+        out[...] = shared['out']
+        return out
@@ -0,0 +1,223 @@
+# module external
+"""Single linkage over complete graphs too large for memory.
+
+The edges are generated in chunks of (p1, p2, length) arrays, from a
+cloud or a matrix file, without ever holding all of them.  The chunks
+are sorted into runs of bounded size, spilled to temporary files in a
+compact binary edge format, then merged back, a bounded number of
+files at a time, into a stream of sorted chunks that Dendrogram.build
+consumes, stopping (and removing the files) as soon as the n-1 merges
+are done.
+
+Edge files are raw arrays of records (length, p1, p2): a little-endian
+float64 and two int32 (int64 for 2^31 nodes or more), 16 bytes per
+edge.
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from TD.cloud import Cloud
+from TD.distance import condensed_size, condensed_to_pairs, band_distances
+from TD.graph import Graph, read_matrix_header, read_matrix_rows, is_condensed_file, open_condensed
+from TD.dendrogram import Dendrogram
+
+DEFAULT_MEMORY_BUDGET = 256 << 20  # bytes
+MERGE_FAN_IN = 16  # runs merged at once
+
+
+def _edge_dtype(n: int) -> np.dtype:
+    index = '<i4' if n < 2**31 else '<i8'
+    return np.dtype([('length', '<f8'), ('p1', index), ('p2', index)])
+
+
+def _chunk_edges(memory_budget: int) -> int:
+    """Number of edges per generated chunk: a quarter of the budget."""
+    return max(1, memory_budget // (4 * _edge_dtype(0).itemsize))
+
+
+def cloud_edges(c: Cloud, chunk_edges: int):
+    """Yield the edges of the complete graph of c as (p1, p2, length)
+    arrays of about chunk_edges edges (bands of rows of the lower
+    triangle, see TD.distance), in the order of graph_from_cloud before
+    sorting.
+    """
+    X = c.coords
+    n = len(c)
+    a = 1
+    while a < n:
+        start = condensed_size(a)
+        b = min(n, max(a + 1, int(condensed_to_pairs(start + chunk_edges)[0])))
+        stop = condensed_size(b)
+        yield (*condensed_to_pairs(np.arange(start, stop)), band_distances(X, a, b))
+        a = b
+
+
+def matrix_file_edges(filename: str, chunk_edges: int):
+    """The node names of a matrix file (text or binary, see
+    graph_from_matrix_file) and a generator of its edges as
+    (p1, p2, length) arrays of about chunk_edges edges.
+    """
+    if is_condensed_file(filename):
+        node_names, lengths = open_condensed(filename)
+
+        def chunks():
+            for start in range(0, len(lengths), chunk_edges):
+                stop = min(start + chunk_edges, len(lengths))
+                yield (*condensed_to_pairs(np.arange(start, stop)),
+                       np.asarray(lengths[start:stop], dtype=np.float64))
+    else:
+        with open(filename, 'r') as f:
+            node_names = read_matrix_header(f)
+
+        def chunks():
+            with open(filename, 'r') as f:
+                n = len(read_matrix_header(f))
+                rows, start, stop = [], 0, 0
+                for row in read_matrix_rows(f, n):
+                    rows.append(row)
+                    stop += len(row)
+                    if stop - start >= chunk_edges:
+                        yield (*condensed_to_pairs(np.arange(start, stop)), np.concatenate(rows))
+                        rows, start = [], stop
+                if stop > start:
+                    yield (*condensed_to_pairs(np.arange(start, stop)), np.concatenate(rows))
+    return node_names, chunks()
+
+
+def _sorted_records(records: np.ndarray) -> np.ndarray:
+    return records[np.lexsort((records['p2'], records['p1'], records['length']))]
+
+
+def _as_chunk(records: np.ndarray):
+    return records['p1'], records['p2'], records['length']
+
+
+def sort_edge_chunks(chunks, n: int, memory_budget: int = DEFAULT_MEMORY_BUDGET, tmp_dir: str = None):
+    """Yield the edges of the (p1, p2, length) chunks, over n nodes, as
+    chunks sorted by (length, p1, p2) with p1 > p2, as in the edge arrays
+    of a graph, holding at most about memory_budget bytes of edges.
+
+    Runs of a third of the budget are sorted and written to a temporary
+    directory in tmp_dir (removed when the generator is exhausted or
+    closed), then merged MERGE_FAN_IN at a time (see _merge_runs), in
+    as many passes as needed, so that neither the memory nor the number
+    of open files depends on n.  If all the edges fit in a single run,
+    nothing is written.
+    """
+    dtype = _edge_dtype(n)
+    run_edges = max(1, memory_budget // (3 * dtype.itemsize))
+    block = max(1, memory_budget // (3 * MERGE_FAN_IN * dtype.itemsize))
+    directory = None
+    runs = []
+    try:
+        pending, count = [], 0
+        for p1, p2, length in chunks:
+            records = np.empty(len(length), dtype=dtype)
+            records['length'] = length
+            records['p1'] = np.maximum(p1, p2)
+            records['p2'] = np.minimum(p1, p2)
+            pending.append(records)
+            count += len(records)
+            if count >= run_edges:
+                if directory is None:
+                    directory = tempfile.mkdtemp(prefix='td-edges-', dir=tmp_dir)
+                runs.append(os.path.join(directory, f'run{len(runs)}.edges'))
+                _sorted_records(np.concatenate(pending)).tofile(runs[-1])
+                pending, count = [], 0
+        last = _sorted_records(np.concatenate(pending)) if pending else np.empty(0, dtype=dtype)
+        pending = None
+        if not runs:
+            if len(last) > 0:
+                yield _as_chunk(last)
+            return
+        if len(last) > 0:
+            runs.append(os.path.join(directory, f'run{len(runs)}.edges'))
+            last.tofile(runs[-1])
+        last = None
+        merged = len(runs)
+        while len(runs) > MERGE_FAN_IN:
+            next_runs = []
+            for start in range(0, len(runs), MERGE_FAN_IN):
+                group = runs[start:start + MERGE_FAN_IN]
+                next_runs.append(os.path.join(directory, f'run{merged}.edges'))
+                merged += 1
+                with open(next_runs[-1], 'wb') as f:
+                    for records in _merge_runs(group, dtype, block):
+                        records.tofile(f)
+                for run in group:
+                    os.remove(run)
+            runs = next_runs
+        for records in _merge_runs(runs, dtype, block):
+            yield _as_chunk(records)
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _merge_runs(runs: [str], dtype: np.dtype, block: int):
+    """k-way merge of the sorted edge files runs, reading block edges
+    of each at a time: yield sorted arrays of records.
+
+    At each step, every buffered edge up to the smallest last edge of
+    the buffers of the runs not read to the end can be output: the rest
+    of each run comes after the last edge of its buffer.
+    """
+    files = [open(run, 'rb') for run in runs]
+    try:
+        buffers = [np.fromfile(f, dtype=dtype, count=block) for f in files]
+        more = [len(buf) == block for buf in buffers]
+        while any(len(buf) > 0 for buf in buffers):
+            lasts = [tuple(buf[-1].tolist()) for buf, m in zip(buffers, more) if m]
+            if lasts:
+                t_length, t_p1, t_p2 = min(lasts)
+            out = []
+            for k, buf in enumerate(buffers):
+                if lasts:
+                    l, p1, p2 = buf['length'], buf['p1'], buf['p2']
+                    take = np.count_nonzero(
+                        (l < t_length) | ((l == t_length) & ((p1 < t_p1) | ((p1 == t_p1) & (p2 <= t_p2)))))
+                else:
+                    take = len(buf)
+                out.append(buf[:take])
+                buffers[k] = buf[take:]
+                if len(buffers[k]) == 0 and more[k]:
+                    buffers[k] = np.fromfile(files[k], dtype=dtype, count=block)
+                    more[k] = len(buffers[k]) == block
+            yield _sorted_records(np.concatenate(out))
+    finally:
+        for f in files:
+            f.close()
+
+
+def external_dendrogram(node_names: [str], chunks, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                        tmp_dir: str = None) -> Dendrogram:
+    """The dendrogram built over the edges of the (p1, p2, length)
+    chunks (see cloud_edges, matrix_file_edges), sorted externally (see
+    sort_edge_chunks) within memory_budget bytes.
+    """
+    g = Graph()
+    g.add_nodes(node_names)
+    d = Dendrogram(g)
+    d.build(sort_edge_chunks(chunks, len(node_names), memory_budget, tmp_dir))
+    return d
+
+
+def external_dendrogram_from_cloud(c: Cloud, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                                   tmp_dir: str = None) -> Dendrogram:
+    """The single-linkage dendrogram of c, over its complete graph
+    sorted out of core."""
+    chunks = cloud_edges(c, _chunk_edges(memory_budget))
+    return external_dendrogram(c.names, chunks, memory_budget, tmp_dir)
+
+
+def external_dendrogram_from_matrix_file(filename: str, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                                         tmp_dir: str = None) -> Dendrogram:
+    """The dendrogram of the graph of a matrix file (see
+    graph_from_matrix_file), sorted out of core."""
+    node_names, chunks = matrix_file_edges(filename, _chunk_edges(memory_budget))
+    return external_dendrogram(node_names, chunks, memory_budget, tmp_dir)
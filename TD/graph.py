@@ -1,5 +1,8 @@
+import bisect
+import struct
 import numpy as np
-from TD.cloud import Point, Cloud
+from TD.cloud import Point, Cloud, NameTable, write_name_table
+from TD.distance import condensed_distances, condensed_to_pairs
 
 class Edge:
     """An edge in a Point graph.
@@ -43,12 +46,26 @@ class Graph:
     node_names : [str]
 
     Il faut ici voir node_names[i] comme le nom du point i dans le Cloud associé.
+
+    Edges given to bulk_add_edges are kept aside, and only sorted and
+    merged into edges when the edges are next read.
     """
 
     def __init__(self):
-        self.edges = []
+        self._edges = []
+        self._pending = []
         self.node_names = []
 
+    @property
+    def edges(self) -> [Edge]:
+        self._flush()
+        return self._edges
+
+    @edges.setter
+    def edges(self, es: [Edge]) -> None:
+        self._edges = sorted(es)
+        self._pending = []
+
     def __str__(self):
         n = len(self.node_names)
         if n == 0:
@@ -85,6 +102,23 @@ class Graph:
         """The i-th edge of the (length-sorted) edge list."""
         return self.edges[i]
 
+    def edge_arrays(self):
+        """The edges as three arrays (p1, p2, length), in edge order.
+
+        The edge list is first sorted again (stably) if it was changed
+        out of order in place, e.g. by g.edges.append.
+        """
+        edges = self.edges
+        m = len(edges)
+        p1 = np.fromiter((e.p1 for e in edges), dtype=np.int64, count=m)
+        p2 = np.fromiter((e.p2 for e in edges), dtype=np.int64, count=m)
+        length = np.fromiter((e.length for e in edges), dtype=np.float64, count=m)
+        if np.any(length[1:] < length[:-1]):
+            order = np.argsort(length, kind='stable')
+            edges.sort()
+            p1, p2, length = p1[order], p2[order], length[order]
+        return p1, p2, length
+
     def add_nodes(self, ns: [str]) -> None:
         """Add a list of (names of) nodes to the graph."""
         # TODO: Exercise 4
@@ -93,61 +127,408 @@ class Graph:
     def add_edges(self, es: [Edge]) -> None:
         """Add a list of edges to the graph,
         maintaining the length-sorted invariant.
+
+        Only the new edges are sorted; they are then inserted after the
+        existing edges of the same length.
         """
         # TODO: Exercise 4
-        self.edges.extend(es)
-        self.edges.sort()
+        self._flush()
+        self._insert_sorted(sorted(es))
+
+    def bulk_add_edges(self, es: [Edge]) -> None:
+        """Add a list of edges to the graph, deferring the sort until
+        the edges are next read.
+        """
+        self._pending.extend(es)
+
+    def _flush(self) -> None:
+        if self._pending:
+            es, self._pending = self._pending, []
+            self._insert_sorted(sorted(es))
+
+    def _insert_sorted(self, es: [Edge]) -> None:
+        """Merge the sorted list es into the sorted edge list."""
+        if not es:
+            return
+        edges = self._edges
+        res = []
+        prev = 0
+        for e in es:
+            pos = bisect.bisect_right(edges, e, prev)
+            res.extend(edges[prev:pos])
+            res.append(e)
+            prev = pos
+        res.extend(edges[prev:])
+        self._edges = res
+
+
+class _EdgeView:
+    """Read-only sequence of the edges of an ArrayGraph; the Edge
+    objects are only created when accessed.
+    """
+
+    def __init__(self, g):
+        self._g = g
+
+    def __len__(self):
+        return len(self._g.length)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._g.get_edge(i)
+
+    def __iter__(self):
+        g = self._g
+        for start in range(0, len(g.length), 4096):
+            stop = start + 4096
+            for e in zip(g.p1[start:stop].tolist(), g.p2[start:stop].tolist(),
+                         g.length[start:stop].tolist()):
+                yield Edge(*e)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ArrayGraph(Graph):
+    """
+    A Graph storing its edges as three parallel arrays sorted by
+    non-decreasing length, instead of a list of Edge objects.
+
+    Attributes
+    ----------
+    p1, p2 : np.ndarray -- the end points of the edges
+    length : np.ndarray -- the lengths of the edges
+    edges : sequence of Edge -- view materializing Edges on demand
+    node_names : [str]
+
+    With compact=True, the indices are stored as int32 and the lengths
+    as float32 (12 bytes per edge instead of 24).
+    """
+
+    def __init__(self, compact: bool = False):
+        self.node_names = []
+        self.index_dtype = np.dtype(np.int32 if compact else np.int64)
+        self.length_dtype = np.dtype(np.float32 if compact else np.float64)
+        self._p1 = np.empty(0, dtype=self.index_dtype)
+        self._p2 = np.empty(0, dtype=self.index_dtype)
+        self._length = np.empty(0, dtype=self.length_dtype)
+        self._pending = []
+
+    @property
+    def p1(self) -> np.ndarray:
+        self._flush()
+        return self._p1
+
+    @property
+    def p2(self) -> np.ndarray:
+        self._flush()
+        return self._p2
+
+    @property
+    def length(self) -> np.ndarray:
+        self._flush()
+        return self._length
+
+    @property
+    def edges(self):
+        return _EdgeView(self)
+
+    @edges.setter
+    def edges(self, es: [Edge]) -> None:
+        self._set_edge_arrays(*(np.empty(0, dtype=a.dtype) for a in (self._p1, self._p2, self._length)))
+        self._insert_sorted(*_edge_list_arrays(es))
+
+    def __iter__(self):
+        return iter(self.edges)
+
+    def edge_count(self):
+        return len(self.length)
+
+    def get_edge(self, i: int) -> Edge:
+        """The i-th edge of the (length-sorted) edge list."""
+        self._flush()
+        return Edge(int(self._p1[i]), int(self._p2[i]), float(self._length[i]))
+
+    def edge_arrays(self):
+        self._flush()
+        return self._p1, self._p2, self._length
+
+    def _set_edge_arrays(self, p1, p2, length) -> None:
+        """Replace the edges by the given, already sorted, arrays."""
+        self._p1 = np.asarray(p1, dtype=self.index_dtype)
+        self._p2 = np.asarray(p2, dtype=self.index_dtype)
+        self._length = np.asarray(length, dtype=self.length_dtype)
+        self._pending = []
+
+    def add_edges(self, es: [Edge]) -> None:
+        """Add a list of edges to the graph,
+        maintaining the length-sorted invariant.
+        """
+        self.add_edge_arrays(*_edge_list_arrays(es))
+
+    def bulk_add_edges(self, es: [Edge]) -> None:
+        """Add a list of edges to the graph, deferring the sort until
+        the edges are next read.
+        """
+        self._pending.append(_edge_list_arrays(es))
 
+    def add_edge_arrays(self, p1, p2, length) -> None:
+        """Add the edges (p1[k], p2[k], length[k]) to the graph,
+        maintaining the length-sorted invariant.
+
+        Only the new edges are sorted; they are then inserted after the
+        existing edges of the same length.
+        """
+        self._flush()
+        self._insert_sorted(p1, p2, length)
+
+    def bulk_add_edge_arrays(self, p1, p2, length) -> None:
+        """Same as add_edge_arrays, deferring the sort until the edges
+        are next read.
+        """
+        self._pending.append((p1, p2, length))
+
+    def _flush(self) -> None:
+        if self._pending:
+            batches, self._pending = self._pending, []
+            self._insert_sorted(*(np.concatenate(a) for a in zip(*batches)))
+
+    def _insert_sorted(self, p1, p2, length) -> None:
+        length = np.asarray(length, dtype=self.length_dtype)
+        if len(length) == 0:
+            return
+        order = np.argsort(length, kind='stable')
+        length = length[order]
+        p1 = np.asarray(p1, dtype=self.index_dtype)[order]
+        p2 = np.asarray(p2, dtype=self.index_dtype)[order]
+        # Final positions of the new edges, after the old ones of equal length
+        pos = np.searchsorted(self._length, length, side='right') + np.arange(len(length))
+        old = np.ones(len(self._length) + len(length), dtype=bool)
+        old[pos] = False
+        for name, new in (('_p1', p1), ('_p2', p2), ('_length', length)):
+            res = np.empty(len(old), dtype=new.dtype)
+            res[old] = getattr(self, name)
+            res[pos] = new
+            setattr(self, name, res)
+
+
+def _edge_list_arrays(es: [Edge]):
+    return [e.p1 for e in es], [e.p2 for e in es], [e.length for e in es]
+
+
+def connected_components(n: int, p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
+    """The smallest node of the connected component of each of the n
+    nodes of the graph with edges (p1, p2), by hooking and pointer
+    jumping.
+    """
+    label = np.arange(n)
+    while True:
+        a, b = label[p1], label[p2]
+        differ = a != b
+        if not differ.any():
+            return label
+        np.minimum.at(label, np.maximum(a[differ], b[differ]), np.minimum(a[differ], b[differ]))
+        while True:
+            nxt = label[label]
+            if np.array_equal(nxt, label):
+                break
+            label = nxt
+
+
+_PAIRS_CHUNK = 1 << 20
 
-def graph_from_cloud(c: Cloud):
+
+def graph_from_condensed(node_names: [str], lengths, compact: bool = False):
+    """Construct the complete graph on the given list of node names with
+    the lengths of the edges given in condensed order (see TD.distance):
+    the length of the edge between nodes i and j < i is lengths[i(i-1)/2 + j].
+
+    The edges are sorted a single time; edges of equal length keep the
+    order (1,0), (2,0), (2,1), (3,0), ...  The result is an ArrayGraph
+    (with int32/float32 arrays if compact).
+    """
+    res = ArrayGraph(compact)
+    res.add_nodes(node_names)
+    lengths = np.asarray(lengths, dtype=res.length_dtype)
+    order = np.argsort(lengths, kind='stable')
+    # Convert the sorted indices to pairs a chunk at a time, so that the
+    # 64-bit temporaries stay small next to the (possibly 32-bit) result
+    p1 = np.empty(len(order), dtype=res.index_dtype)
+    p2 = np.empty(len(order), dtype=res.index_dtype)
+    for start in range(0, len(order), _PAIRS_CHUNK):
+        chunk = slice(start, start + _PAIRS_CHUNK)
+        p1[chunk], p2[chunk] = condensed_to_pairs(order[chunk])
+    res._set_edge_arrays(p1, p2, lengths[order])
+    return res
+
+
+def lazy_condensed_edges(lengths, first: int = 1024):
+    """Yield the edges of the complete graph with the given condensed
+    lengths as (p1, p2, length) chunks, in the order of the edges of
+    graph_from_condensed, but sorting them only as they are consumed.
+
+    Each chunk is made of the next first, 2 * first, 4 * first, ...
+    shortest edges (and all the edges of the same length as the last
+    one), selected by np.partition and then sorted: a consumer such as
+    Dendrogram.build, that stops after the minimum spanning tree, never
+    sorts the longer edges.
+    """
+    lengths = np.asarray(lengths)
+    k = max(1, first)
+    above = np.ones(len(lengths), dtype=bool)  # not yielded yet
+    while True:
+        rest = lengths[above]
+        if len(rest) == 0:
+            return
+        if k < len(rest):
+            t = np.partition(rest, k - 1)[k - 1]
+            chunk = np.flatnonzero(above & (lengths <= t))
+            above &= lengths > t
+        else:
+            chunk = np.flatnonzero(above)
+            above[:] = False
+        rest = None
+        chunk = chunk[np.argsort(lengths[chunk], kind='stable')]
+        yield (*condensed_to_pairs(chunk), lengths[chunk])
+        k *= 2
+
+
+def graph_from_cloud(c: Cloud, compact: bool = False, workers: int = None):
     """Construct the complete graph whose nodes are names of points in c
     and where the length of the edge between two points is the Euclidean
     distance between them.
+
+    All the distances are computed at once (see TD.distance), by that
+    many worker processes if workers > 1 (0 for all the CPUs), then the
+    graph is built by graph_from_condensed.
     """
-    res = Graph()
     # TODO: Exercise 5
-    for i in range(len(c)):
-        for j in range(i):
-            p1 = c[i]
-            p2 = c[j]
-            length = p1.dist(p2)
-            e = Edge(i, j, length)
-            res.add_edges([e])
-        res.add_nodes([c[i].name])
-    return res
+    dtype = np.float32 if compact else np.float64
+    lengths = condensed_distances(c.coords, dtype=dtype, workers=workers)
+    return graph_from_condensed(c.names, lengths, compact)
 
 
-def graph_from_matrix(node_names: [str], dist_matrix: [[float]]):
+def graph_from_matrix(node_names: [str], dist_matrix: [[float]], compact: bool = False):
     """Construct the complete graph on the given list of node names
     with the length of the edge between nodes i and j given by the
     (i,j)-th entry of the matrix.
+
+    Only the lower triangle of the matrix is used: the rows may be
+    lists of any length from i on (e.g. [[0], [1, 0], [2, 3, 0]]).
     """
-    res = Graph()
     # TODO: Exercise 6
-    for i in range(len(node_names)):
-        for j in range(i):
-            p1 = node_names[i]
-            p2 = node_names[j]
-            length = dist_matrix[i][j]
-            e = Edge(i, j, length)
-            res.add_edges([e])
-        res.add_nodes([node_names[i]])
-    return res
+    n = len(node_names)
+    if isinstance(dist_matrix, np.ndarray) and dist_matrix.ndim == 2:
+        p1, p2 = np.tril_indices(n, -1)
+        lengths = dist_matrix[p1, p2]
+    else:
+        if len(dist_matrix) < n:
+            raise ValueError(f'The distance matrix has {len(dist_matrix)} rows for {n} nodes')
+        rows = []
+        for i in range(n):
+            row = np.asarray(dist_matrix[i][:i], dtype=np.float64)
+            if len(row) != i:
+                raise ValueError(f'Row {i} of the distance matrix has fewer than {i} entries')
+            rows.append(row)
+        lengths = np.concatenate(rows) if rows else np.empty(0)
+    return graph_from_condensed(node_names, lengths, compact)
+
+
+def read_matrix_header(f) -> [str]:
+    """Read the number of nodes and their names from a matrix file."""
+    n = int(f.readline())
+    return [f.readline().strip() for _ in range(n)]
+
+
+def read_matrix_rows(f, n: int):
+    """Yield the lower-triangle part (the first i entries) of each row i
+    of the distance matrix of a matrix file, parsing only that part.
+    """
+    for i in range(n):
+        line = f.readline()
+        row = np.fromstring(line, sep=',', count=i) if i > 0 else np.empty(0)
+        if len(row) != i:
+            raise ValueError(f'Row {i} of the distance matrix has fewer than {i} entries')
+        yield row
+
+
+def read_matrix_file(filename: str):
+    """Read a matrix file (see graph_from_matrix_file) into the list of
+    node names and the condensed array of the distances.
+    """
+    with open(filename, 'r') as f:
+        node_names = read_matrix_header(f)
+        n = len(node_names)
+        lengths = np.empty(n * (n - 1) // 2)
+        for i, row in enumerate(read_matrix_rows(f, n)):
+            lengths[i * (i - 1) // 2:i * (i + 1) // 2] = row
+    return node_names, lengths
+
+
+# Binary condensed matrix files, as for clouds (see TD.cloud): a 64-byte
+# header (magic string, n, dtype, offset of the name table), the
+# n(n-1)/2 condensed distances from byte 64, then the name table.
+
+_CONDENSED_MAGIC = b'TDCONDS1'
+_CONDENSED_HEADER = struct.Struct('<8sQ8sQ')
+_CONDENSED_HEADER_SIZE = 64
 
-def graph_from_matrix_file(filename):
+
+def save_condensed(filename: str, node_names: [str], lengths) -> None:
+    """Save the node names and the condensed distances in the binary
+    format read by open_condensed."""
+    n = len(node_names)
+    lengths = np.asarray(lengths)
+    if len(lengths) != n * (n - 1) // 2:
+        raise ValueError(f'{len(lengths)} distances for {n} nodes')
+    dtype = lengths.dtype.newbyteorder('<')
+    names_offset = _CONDENSED_HEADER_SIZE + len(lengths) * dtype.itemsize
+    with open(filename, 'wb') as f:
+        f.write(_CONDENSED_HEADER.pack(_CONDENSED_MAGIC, n, dtype.str.encode(), names_offset)
+                .ljust(_CONDENSED_HEADER_SIZE, b'\0'))
+        np.ascontiguousarray(lengths, dtype=dtype).tofile(f)
+        write_name_table(f, node_names)
+
+
+def open_condensed(filename: str):
+    """Open a file saved by save_condensed: return the node names (decoded
+    on access) and the memory-mapped condensed distances.
+    """
+    with open(filename, 'rb') as f:
+        magic, n, dtype, names_offset = _CONDENSED_HEADER.unpack(f.read(_CONDENSED_HEADER.size))
+    if magic != _CONDENSED_MAGIC:
+        raise ValueError(f'{filename} is not a condensed matrix file')
+    dtype = np.dtype(dtype.rstrip(b'\0').decode())
+    m = n * (n - 1) // 2
+    lengths = (np.memmap(filename, dtype=dtype, mode='r', offset=_CONDENSED_HEADER_SIZE, shape=(m,))
+               if m > 0 else np.empty(0, dtype=dtype))
+    return NameTable.from_file(filename, names_offset, n), lengths
+
+
+def is_condensed_file(filename: str) -> bool:
+    """Whether the named file is in the binary format of save_condensed."""
+    with open(filename, 'rb') as f:
+        return f.read(len(_CONDENSED_MAGIC)) == _CONDENSED_MAGIC
+
+
+def convert_matrix_file(filename: str, condensed_filename: str) -> None:
+    """Convert a (text) matrix file to the binary condensed format."""
+    save_condensed(condensed_filename, *read_matrix_file(filename))
+
+
+def graph_from_matrix_file(filename, compact: bool = False):
     """Construct the graph specified in the named file.  The first line
     in the file is the number n of nodes; the next n lines give the node
     names; and the following n lines are the rows of the distance matrix
     (n entries per line, comma-separated).
+
+    The file can also be in the binary condensed format (see
+    save_condensed), which is memory-mapped instead of parsed.
     """
     # TODO: Exercise 6
-    node_names = []
-    dist_matrix = []
-    with open(filename, 'r') as f:
-        n = int(f.readline())
-        for _ in range(n):
-            node_names.append(f.readline().strip())
-        for _ in range(n):
-            dist_matrix.append([float(x) for x in f.readline().strip().split(',')])
-    return graph_from_matrix(node_names, dist_matrix)
-
+    if is_condensed_file(filename):
+        node_names, lengths = open_condensed(filename)
+    else:
+        node_names, lengths = read_matrix_file(filename)
+    return graph_from_condensed(node_names, lengths, compact)
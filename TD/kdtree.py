@@ -0,0 +1,93 @@
+# module kdtree
+"""A minimal KD-tree, stored as arrays."""
+
+import math
+import numpy as np
+
+
+class KDTree:
+    """
+    A KD-tree over the rows of an (n, d) array.
+
+    Each node covers a contiguous range start..end-1 of the reordered
+    points; nodes are split at the median of their widest dimension
+    until they hold at most leaf_size points.  Children are numbered
+    after their parent, so iterating over the nodes in reverse order
+    visits the children before the parents.
+
+    Attributes
+    ----------
+    data : np.ndarray -- the points, reordered
+    index : np.ndarray -- original index of each row of data
+    start, end : np.ndarray -- range of each node in data
+    left, right : np.ndarray -- children of each node (-1 for leaves)
+    lo, hi : np.ndarray -- bounding box of each node
+    """
+
+    def __init__(self, coords, leaf_size: int = 32):
+        X = np.asarray(coords)
+        n = X.shape[0]
+        perm = np.arange(n)
+        start, end, left, right = [], [], [], []
+        stack = [(0, n, -1, False)]  # (start, end, parent, is_right_child)
+        while stack:
+            s, e, parent, is_right = stack.pop()
+            node = len(start)
+            start.append(s)
+            end.append(e)
+            left.append(-1)
+            right.append(-1)
+            if parent != -1:
+                (right if is_right else left)[parent] = node
+            if e - s <= leaf_size:
+                continue
+            sub = perm[s:e]
+            pts = X[sub]
+            dim = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+            k = (e - s) // 2
+            perm[s:e] = sub[np.argpartition(pts[:, dim], k)]
+            stack.append((s + k, e, node, True))
+            stack.append((s, s + k, node, False))
+        self.index = perm
+        self.data = X[perm]
+        self.start = np.array(start)
+        self.end = np.array(end)
+        self.left = np.array(left)
+        self.right = np.array(right)
+        d = X.shape[1] if X.ndim == 2 else 0
+        self.lo = np.empty((len(start), d), dtype=self.data.dtype)
+        self.hi = np.empty((len(start), d), dtype=self.data.dtype)
+        for node in reversed(range(len(start))):  # Children first
+            l, r = left[node], right[node]
+            if l == -1:
+                if end[node] > start[node]:
+                    self.lo[node] = self.data[start[node]:end[node]].min(axis=0)
+                    self.hi[node] = self.data[start[node]:end[node]].max(axis=0)
+            else:
+                self.lo[node] = np.minimum(self.lo[l], self.lo[r])
+                self.hi[node] = np.maximum(self.hi[l], self.hi[r])
+        self._lo = self.lo.tolist()
+        self._hi = self.hi.tolist()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def node_count(self) -> int:
+        return len(self.start)
+
+    def is_leaf(self, node: int) -> bool:
+        return self.left[node] == -1
+
+    def leaves(self) -> np.ndarray:
+        """The leaves, by increasing start."""
+        leaves = np.flatnonzero(self.left == -1)
+        return leaves[np.argsort(self.start[leaves])]
+
+    def box_dist(self, a: int, b: int) -> float:
+        """Lower bound on the distance between points of nodes a and b."""
+        # Plain Python: much faster than numpy on a few coordinates
+        s = 0.0
+        for lo_a, hi_a, lo_b, hi_b in zip(self._lo[a], self._hi[a], self._lo[b], self._hi[b]):
+            gap = max(lo_b - hi_a, lo_a - hi_b, 0.0)
+            s += gap * gap
+        return math.sqrt(s)
@@ -0,0 +1,245 @@
+# module knn
+"""Approximate k-nearest-neighbour graphs of clouds.
+
+For high-dimensional points, neither the complete graph nor a KD-tree
+scales.  The k nearest neighbours of every point are approximated by
+random projection trees (points in the same leaf are candidates), then
+refined by NN-descent (the neighbours of a point's neighbours are
+candidates), all with NumPy over batches of candidate pairs.  A repair
+pass then links the connected components of the k-NN graph, so that
+single linkage over it gives a spanning tree whose heights are those
+of the exact minimum spanning tree up to the missed edges.
+"""
+
+import numpy as np
+from TD.graph import connected_components
+
+
+def _pair_distances(X: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """The distances between the points a and b, a block of pairs at a
+    time (same arithmetic as TD.distance)."""
+    d = np.empty(len(a))
+    block = max(1, 2**22 // max(1, X.shape[1]))
+    for s in range(0, len(a), block):
+        d[s:s + block] = np.sqrt(np.sum((X[a[s:s + block]] - X[b[s:s + block]])**2, axis=-1))
+    return d
+
+
+def _update(X: np.ndarray, nbr: np.ndarray, dist: np.ndarray, src: np.ndarray, dst: np.ndarray,
+            comp: np.ndarray = None) -> np.ndarray:
+    """Offer dst as a neighbour to src and src to dst (arrays of pairs,
+    only between different components if comp is given); keep the k
+    closest distinct neighbours of each point in the (n, k) arrays nbr
+    and dist.  Return the (n, k) mask of the new neighbours.
+    """
+    n, k = nbr.shape
+    keep = src != dst if comp is None else comp[src] != comp[dst]
+    src, dst = src[keep], dst[keep]
+    d = _pair_distances(X, src, dst)
+    # Only the candidates closer than the current k-th neighbour matter
+    worst = dist[:, -1]
+    to_src, to_dst = d < worst[src], d < worst[dst]
+    s = np.concatenate((np.repeat(np.arange(n), k), src[to_src], dst[to_dst]))
+    t = np.concatenate((nbr.ravel(), dst[to_src], src[to_dst]))
+    dd = np.concatenate((dist.ravel(), d[to_src], d[to_dst]))
+    valid = t >= 0
+    s, t, dd = s[valid], t[valid], dd[valid]
+    if len(s) == 0:
+        return np.zeros(nbr.shape, dtype=bool)
+    order = np.lexsort((t, dd, s))
+    s, t, dd = s[order], t[order], dd[order]
+    distinct = np.r_[True, (s[1:] != s[:-1]) | (t[1:] != t[:-1])]
+    s, t, dd = s[distinct], t[distinct], dd[distinct]
+    first = np.flatnonzero(np.r_[True, s[1:] != s[:-1]])
+    rank = np.arange(len(s)) - np.repeat(first, np.diff(np.r_[first, len(s)]))
+    top = rank < k
+    new_nbr = np.full_like(nbr, -1)
+    new_dist = np.full_like(dist, np.inf)
+    new_nbr[s[top], rank[top]] = t[top]
+    new_dist[s[top], rank[top]] = dd[top]
+    rows = np.repeat(np.arange(n, dtype=np.int64), k)
+    new = ~np.isin(rows * n + new_nbr.ravel(), rows * n + nbr.ravel()) & (new_nbr.ravel() >= 0)
+    nbr[...] = new_nbr
+    dist[...] = new_dist
+    return new.reshape(n, k)
+
+
+def _rp_leaves(X: np.ndarray, leaf_size: int, rng) -> [np.ndarray]:
+    """The leaves of a random projection tree: each node is split at the
+    median of the projections of its points on the line through two of
+    them, chosen at random."""
+    leaves = []
+    stack = [np.arange(X.shape[0])]
+    while stack:
+        idx = stack.pop()
+        if len(idx) <= leaf_size:
+            leaves.append(idx)
+            continue
+        a, b = rng.choice(idx, 2, replace=False)
+        proj = X[idx] @ (X[a] - X[b])
+        half = len(idx) // 2
+        part = np.argpartition(proj, half)
+        stack.append(idx[part[:half]])
+        stack.append(idx[part[half:]])
+    return leaves
+
+
+def knn_neighbours(coords, k: int = 10, trees: int = 4, leaf_size: int = None,
+                   iterations: int = 4, seed: int = 0, comp: np.ndarray = None):
+    """The (n, k) arrays of the approximate k nearest neighbours of each
+    row of coords (-1 if fewer than k were found) and their distances,
+    from trees random projection trees with leaves of leaf_size points,
+    then at most iterations rounds of NN-descent (stopping early when
+    fewer than 0.1% of the neighbours are new).  If comp is given, the
+    neighbours of a point are searched outside its component comp[i].
+    """
+    X = np.asarray(coords)
+    n = X.shape[0]
+    rng = np.random.default_rng(seed)
+    if leaf_size is None:
+        leaf_size = max(2 * k, 32)
+    nbr = np.full((n, k), -1, dtype=np.int64)
+    dist = np.full((n, k), np.inf)
+    for _ in range(trees):
+        src, dst = [], []
+        for leaf in _rp_leaves(X, leaf_size, rng):
+            i, j = np.triu_indices(len(leaf), 1)
+            src.append(leaf[i])
+            dst.append(leaf[j])
+        if src:
+            _update(X, nbr, dist, np.concatenate(src), np.concatenate(dst), comp)
+    # Local join: the neighbours of each point, and (up to k of) the
+    # points of which it is a neighbour, are offered to each other, if
+    # at least one of them is new since the previous round.
+    new = nbr >= 0
+    i, j = np.triu_indices(2 * k, 1)
+    for _ in range(iterations):
+        rev, rev_new = _reverse(nbr, new, rng)
+        near = np.concatenate((nbr, rev), axis=1)
+        near_new = np.concatenate((new, rev_new), axis=1)
+        src, dst = near[:, i].ravel(), near[:, j].ravel()
+        join = (src >= 0) & (dst >= 0) & (near_new[:, i] | near_new[:, j]).ravel()
+        new = _update(X, nbr, dist, src[join], dst[join], comp)
+        if np.count_nonzero(new) < 0.001 * n * k:
+            break
+    return nbr, dist
+
+
+def _reverse(nbr: np.ndarray, new: np.ndarray, rng):
+    """An (n, k) array of up to k points (at random) having each point as
+    a neighbour in nbr, -1 for the missing ones, and whether it is new
+    (see _update) for them."""
+    n, k = nbr.shape
+    t = nbr.ravel()
+    s = np.repeat(np.arange(n), k)
+    found = t >= 0
+    t, s, is_new = t[found], s[found], new.ravel()[found]
+    order = np.lexsort((rng.random(len(t)), t))
+    t, s, is_new = t[order], s[order], is_new[order]
+    first = np.flatnonzero(np.r_[True, t[1:] != t[:-1]])
+    rank = np.arange(len(t)) - np.repeat(first, np.diff(np.r_[first, len(t)]))
+    rev = np.full_like(nbr, -1)
+    rev_new = np.zeros_like(new)
+    top = rank < k
+    rev[t[top], rank[top]] = s[top]
+    rev_new[t[top], rank[top]] = is_new[top]
+    return rev, rev_new
+
+
+def _closest_outside(X: np.ndarray, rows: np.ndarray, inside: np.ndarray):
+    """The closest pair (i, j, length) between the points rows and the
+    points not inside (a boolean mask)."""
+    best = (-1, -1, np.inf)
+    block = max(1, 2**20 // max(1, X.shape[0] * X.shape[1]))
+    for s in range(0, len(rows), block):
+        r = rows[s:s + block]
+        D = np.sqrt(np.sum((X[r][:, None, :] - X[None, :, :])**2, axis=-1))
+        D[:, inside] = np.inf
+        a, b = np.unravel_index(int(D.argmin()), D.shape)
+        if D[a, b] < best[2]:
+            best = (int(r[a]), int(b), float(D[a, b]))
+    return best
+
+
+def _alternate(X: np.ndarray, members: np.ndarray, inside: np.ndarray, i: int, j: int, d: float):
+    """Improve the edge (i, j, d) from the points members (inside, a
+    boolean mask) to the others: the closest member to j, then the
+    closest point outside to it, until the edge gets no shorter."""
+    while True:
+        m = int(members[np.argmin(_pair_distances(X, np.full(len(members), j), members))])
+        m, o, d_mo = _closest_outside(X, np.array([m]), inside)
+        if d_mo >= d:
+            return i, j, d
+        i, j, d = m, o, d_mo
+
+
+def repair_edges(coords, p1: np.ndarray, p2: np.ndarray, k: int = 4, trees: int = 8, samples: int = 64,
+                 seed: int = 0):
+    """Edges (p1, p2, length) linking the connected components of the
+    graph on the rows of coords with edges (p1, p2), Boruvka style: in
+    each round every component is linked to the closest point outside
+    found for its points by knn_neighbours (with k neighbours from
+    trees trees) restricted to other components.
+
+    The edges of the components of at least samples points (at most
+    n / samples of them) are then improved by alternating closest
+    points on each side, in O(n) time per step: the closest outside
+    point of a large component is often in none of its leaves.  Those
+    without any point sharing a leaf with another component start from
+    the closest pair from a sample of samples of their points.
+    """
+    X = np.asarray(coords)
+    n = X.shape[0]
+    rng = np.random.default_rng(seed)
+    new_p1, new_p2, new_length = [], [], []
+    comp = connected_components(n, p1, p2)
+    while True:
+        labels, sizes = np.unique(comp, return_counts=True)
+        if len(labels) <= 1:
+            break
+        nbr, dist = knn_neighbours(X, k, trees, seed=int(rng.integers(2**31)), comp=comp)
+        order = np.lexsort((dist[:, 0], comp))
+        best = order[np.r_[True, comp[order][1:] != comp[order][:-1]]]  # Closest point of each component
+        edges = np.stack((best, nbr[best, 0], dist[best, 0]), axis=1).tolist()
+        order = np.argsort(comp, kind='stable')
+        starts = np.r_[0, np.cumsum(sizes)[:-1]]
+        for c in range(len(labels)):
+            i, j, d = edges[c]
+            if sizes[c] < samples and d < np.inf:
+                new_p1.append(int(i))
+                new_p2.append(int(j))
+                new_length.append(d)
+                continue
+            members = order[starts[c]:starts[c] + sizes[c]]
+            inside = np.zeros(n, dtype=bool)
+            inside[members] = True
+            if d == np.inf:
+                rows = members if len(members) <= samples else rng.choice(members, samples, replace=False)
+                i, j, d = _closest_outside(X, rows, inside)
+            i, j, d = _alternate(X, members, inside, int(i), int(j), d)
+            new_p1.append(i)
+            new_p2.append(j)
+            new_length.append(d)
+        comp = connected_components(n, np.concatenate((p1, new_p1)).astype(np.int64),
+                                    np.concatenate((p2, new_p2)).astype(np.int64))
+    return (np.array(new_p1, dtype=np.int64), np.array(new_p2, dtype=np.int64),
+            np.array(new_length, dtype=np.float64))
+
+
+def knn_edges(coords, k: int = 10, **kwargs):
+    """The edges (p1, p2, length), p1 > p2, of the approximate k-NN graph
+    of the rows of coords (see knn_neighbours, which gets the keyword
+    arguments), plus the repair edges making it connected.
+    """
+    X = np.asarray(coords)
+    nbr, dist = knn_neighbours(X, k, **kwargs)
+    src = np.repeat(np.arange(X.shape[0]), k)
+    found = nbr.ravel() >= 0
+    p1 = np.maximum(src, nbr.ravel())[found]
+    p2 = np.minimum(src, nbr.ravel())[found]
+    length = dist.ravel()[found]
+    _, first = np.unique(p1 * X.shape[0] + p2, return_index=True)
+    p1, p2, length = p1[first], p2[first], length[first]
+    r1, r2, r_length = repair_edges(X, p1, p2)
+    return (np.concatenate((p1, np.maximum(r1, r2))), np.concatenate((p2, np.minimum(r1, r2))),
+            np.concatenate((length, r_length)))
@@ -0,0 +1,114 @@
+# module linkage
+"""Hierarchical clustering with complete, average and Ward linkage.
+
+Unlike single linkage, these criteria do not only depend on the minimum
+spanning tree: they are computed by the nearest-neighbour-chain
+algorithm over the condensed distances (see TD.distance), updated in
+place by the Lance-Williams formulas, in O(n^2) time and no memory
+beyond the condensed array.  The result is a SciPy linkage matrix (see
+Dendrogram.to_linkage), with the same conventions as
+scipy.cluster.hierarchy.linkage.
+"""
+
+import numpy as np
+
+
+def _complete(d_xi, d_yi, d_xy, nx, ny, ni):
+    return np.maximum(d_xi, d_yi)
+
+
+def _average(d_xi, d_yi, d_xy, nx, ny, ni):
+    return (nx * d_xi + ny * d_yi) / (nx + ny)
+
+
+def _ward(d_xi, d_yi, d_xy, nx, ny, ni):
+    t = 1.0 / (nx + ny + ni)
+    return np.sqrt((ni + nx) * t * d_xi * d_xi + (ni + ny) * t * d_yi * d_yi - ni * t * d_xy * d_xy)
+
+
+# Distance from cluster i to the union of clusters x and y, from the
+# distances d_xi, d_yi, d_xy and the sizes of the clusters.
+_LANCE_WILLIAMS = {
+    'complete': _complete,
+    'average': _average,
+    'ward': _ward,
+}
+
+
+def nn_chain_linkage(lengths, method: str = 'complete') -> np.ndarray:
+    """The linkage matrix of the points with the given condensed
+    distances (not modified), for the method 'complete', 'average' or
+    'ward' (which assumes Euclidean distances).
+
+    The chain grows from a cluster to its nearest neighbour (preferring
+    the previous cluster of the chain, then the lowest index, on ties)
+    until two clusters are each other's nearest neighbours; these are
+    merged into the cluster of the higher index.  The merges are then
+    sorted by distance and numbered as in SciPy.
+    """
+    if method not in _LANCE_WILLIAMS:
+        raise ValueError(f'Unknown linkage method {method!r}; expected one of {", ".join(_LANCE_WILLIAMS)}')
+    update = _LANCE_WILLIAMS[method]
+    D = np.array(lengths, dtype=np.float64)
+    n = int((1 + np.sqrt(1 + 8 * len(D))) // 2) if len(D) > 0 else 1
+    base = np.arange(n) * (np.arange(n) - 1) // 2  # start of row i in D
+
+    def row_index(x: int) -> np.ndarray:
+        """The positions in D of the distances from x to 0..n-1 (x itself
+        mapped to 0, to be masked)."""
+        idx = np.zeros(n, dtype=np.int64)
+        idx[:x] = base[x] + np.arange(x)
+        idx[x + 1:] = base[x + 1:] + x
+        return idx
+
+    size = np.ones(n)
+    Z = np.empty((n - 1, 4))
+    chain = []
+    for k in range(n - 1):
+        if not chain:
+            chain.append(int(np.flatnonzero(size > 0)[0]))
+        while True:
+            x = chain[-1]
+            row = D[row_index(x)]
+            row[size == 0] = np.inf
+            row[x] = np.inf
+            y = int(row.argmin())
+            if len(chain) > 1 and row[chain[-2]] <= row[y]:
+                y = chain[-2]
+                break
+            chain.append(y)
+        chain = chain[:-2]
+        current_min = row[y]
+        x, y = min(x, y), max(x, y)
+        nx, ny = size[x], size[y]
+        Z[k] = (x, y, current_min, nx + ny)
+        size[x] = 0
+        size[y] = nx + ny
+        ix, iy = row_index(x), row_index(y)
+        others = np.flatnonzero(size > 0)
+        others = others[others != y]
+        D[iy[others]] = update(D[ix[others]], D[iy[others]], current_min, nx, ny, size[others])
+    Z = Z[np.argsort(Z[:, 2], kind='stable')]
+    _label(Z, n)
+    return Z
+
+
+def _label(Z: np.ndarray, n: int) -> None:
+    """Replace the point indices of the merges by the SciPy numbering of
+    the clusters (n + k for the cluster made by row k), and set the
+    cluster sizes, in place."""
+    parent = list(range(2 * n - 1))
+    size = [1] * n + [0] * (n - 1)
+
+    def find(i: int) -> int:
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+    for k, (x, y) in enumerate(Z[:, :2].astype(np.int64).tolist()):
+        x, y = find(x), find(y)
+        parent[x] = parent[y] = n + k
+        size[n + k] = size[x] + size[y]
+        Z[k] = (min(x, y), max(x, y), Z[k, 2], size[n + k])
@@ -0,0 +1,293 @@
+# module mst
+"""Minimum spanning trees of clouds, computed directly from the
+coordinates without building the complete graph.
+
+Single linkage only depends on the minimum spanning tree: building a
+Dendrogram over its n-1 edges gives the same merge heights as building
+it over the complete graph.
+"""
+
+import numpy as np
+from TD.cloud import Cloud
+from TD.distance import worker_count, worker_array, shared_pool
+from TD.graph import ArrayGraph, connected_components
+from TD.kdtree import KDTree
+from TD.knn import knn_edges
+
+
+def sorted_edges(p1, p2, length):
+    """The edges (p1, p2, length) with p1 > p2 in each edge, sorted by
+    length then (p1, p2): the order in which they appear in the complete
+    graph from graph_from_cloud.
+    """
+    p1, p2 = np.asarray(p1), np.asarray(p2)
+    p1, p2 = np.maximum(p1, p2), np.minimum(p1, p2)
+    length = np.asarray(length)
+    order = np.lexsort((p2, p1, length))
+    return p1[order], p2[order], length[order]
+
+
+def prim_mst(coords):
+    """The edges (p1, p2, length) of a minimum spanning tree of the
+    complete graph on the rows of coords, by dense Prim: O(n^2) time,
+    O(n) memory on top of the coordinates.
+    """
+    X = np.asarray(coords)
+    n = X.shape[0]
+    p1 = np.empty(max(n - 1, 0), dtype=np.int64)
+    p2 = np.empty(max(n - 1, 0), dtype=np.int64)
+    length = np.empty(max(n - 1, 0), dtype=np.float64)
+    best = np.full(n, np.inf)  # distance to the tree (inf once in the tree)
+    best_from = np.zeros(n, dtype=np.int64)
+    in_tree = np.zeros(n, dtype=bool)
+    v = 0
+    for k in range(n - 1):
+        in_tree[v] = True
+        d = np.sqrt(np.sum((X - X[v])**2, axis=1))
+        closer = (d < best) & ~in_tree
+        best[closer] = d[closer]
+        best_from[closer] = v
+        best[v] = np.inf
+        v = int(np.argmin(best))
+        p1[k], p2[k], length[k] = v, best_from[v], best[v]
+    return sorted_edges(p1, p2, length)
+
+
+class _Boruvka:
+    """State of the dual-tree Boruvka algorithm (see boruvka_mst).
+
+    Points are designated by their position in tree.data.  Candidate
+    edges are compared on (length, lo, hi), lo < hi being the positions
+    of their end points: with this total order the minimum spanning
+    tree is unique, so the edges picked in a round never form a cycle.
+    The initial components, if given as comp, are labelled by their
+    smallest position.
+    """
+
+    def __init__(self, tree: KDTree, comp: np.ndarray = None):
+        self.tree = tree
+        n = len(tree)
+        self.uf = np.arange(n) if comp is None else comp.copy()
+        self.comp = self.uf.copy()  # component of each point (its root in uf)
+
+    def run(self):
+        merges = np.count_nonzero(self.uf == np.arange(len(self.tree))) - 1
+        p1, p2, length = [], [], []
+        while len(p1) < merges:
+            lo, hi, d = self._round()
+            for a, b, l in zip(lo.tolist(), hi.tolist(), d.tolist()):
+                ra, rb = self._find(a), self._find(b)
+                if ra != rb:
+                    self.uf[max(ra, rb)] = min(ra, rb)
+                    p1.append(a)
+                    p2.append(b)
+                    length.append(l)
+            self.comp = self._roots()
+        return np.array(p1, dtype=np.int64), np.array(p2, dtype=np.int64), np.array(length)
+
+    def _find(self, i: int) -> int:
+        while self.uf[i] != i:
+            i = self.uf[i]
+        return i
+
+    def _roots(self) -> np.ndarray:
+        uf = self.uf
+        while True:
+            nxt = uf[uf]
+            if np.array_equal(nxt, uf):
+                return uf
+            uf = nxt
+
+    def _round(self):
+        """Find the shortest edge leaving each component but the largest."""
+        tree = self.tree
+        n = len(tree)
+        self.best_d = np.full(n, np.inf)
+        self.best_lo = np.full(n, n)
+        self.best_hi = np.full(n, n)
+        self.bound = np.full(tree.node_count(), np.inf)
+        # The largest component need not look for its edge: the others do
+        self.skip = int(np.bincount(self.comp, minlength=n).argmax())
+        # Component of each node, or -1 if its points are in several
+        self.node_comp = np.full(tree.node_count(), -1)
+        leaves = tree.leaves()
+        cmin = np.minimum.reduceat(self.comp, tree.start[leaves])
+        cmax = np.maximum.reduceat(self.comp, tree.start[leaves])
+        self.node_comp[leaves] = np.where(cmin == cmax, cmin, -1)
+        for node in reversed(range(tree.node_count())):
+            l, r = tree.left[node], tree.right[node]
+            if l != -1 and self.node_comp[l] == self.node_comp[r]:
+                self.node_comp[node] = self.node_comp[l]
+        self._traverse(0, 0, 0.0)
+        roots = np.flatnonzero(self.best_d < np.inf)
+        # Two components may have picked the same edge
+        _, first = np.unique(self.best_lo[roots] * n + self.best_hi[roots], return_index=True)
+        roots = roots[first]
+        return self.best_lo[roots], self.best_hi[roots], self.best_d[roots]
+
+    def _traverse(self, q: int, r: int, dist: float) -> None:
+        """Look for edges from the points of node q to the points of
+        node r, at distance at least dist of each other.
+        """
+        tree = self.tree
+        c = self.node_comp[q]
+        if c == self.skip or (c != -1 and c == self.node_comp[r]) or dist > self.bound[q]:
+            return
+        q_leaf, r_leaf = tree.left[q] == -1, tree.left[r] == -1
+        if q_leaf and r_leaf:
+            self._base_case(q, r)
+            return
+        qs = [q] if q_leaf else [tree.left[q], tree.right[q]]
+        rs = [r] if r_leaf else [tree.left[r], tree.right[r]]
+        for qc in qs:
+            for d, rc in sorted((tree.box_dist(qc, rc), rc) for rc in rs):
+                self._traverse(qc, rc, d)
+        if not q_leaf:
+            self.bound[q] = max(self.bound[qs[0]], self.bound[qs[1]])
+
+    def _base_case(self, q: int, r: int) -> None:
+        tree = self.tree
+        X = tree.data
+        qs, qe = tree.start[q], tree.end[q]
+        rs, re = tree.start[r], tree.end[r]
+        D = np.sqrt(np.sum((X[qs:qe, None, :] - X[None, rs:re, :])**2, axis=-1))
+        cq = self.comp[qs:qe]
+        D[cq[:, None] == self.comp[None, rs:re]] = np.inf
+        d = D.min(axis=1)
+        # For each point of q, its closest point in r (lowest position on ties)
+        r_pos = np.where(D == d[:, None], np.arange(rs, re)[None, :], len(X)).min(axis=1)
+        q_pos = np.arange(qs, qe)
+        keep = (d <= self.best_d[cq]) & (cq != self.skip)
+        if keep.any():
+            c, d = cq[keep], d[keep]
+            lo = np.minimum(q_pos[keep], r_pos[keep])
+            hi = np.maximum(q_pos[keep], r_pos[keep])
+            order = np.lexsort((hi, lo, d, c))
+            first = order[np.r_[True, c[order][1:] != c[order][:-1]]]
+            c, d, lo, hi = c[first], d[first], lo[first], hi[first]
+            bd, blo, bhi = self.best_d[c], self.best_lo[c], self.best_hi[c]
+            better = (d < bd) | ((d == bd) & ((lo < blo) | ((lo == blo) & (hi < bhi))))
+            c = c[better]
+            self.best_d[c] = d[better]
+            self.best_lo[c] = lo[better]
+            self.best_hi[c] = hi[better]
+        self.bound[q] = self.best_d[cq[cq != self.skip]].max()
+
+
+def boruvka_mst(coords, leaf_size: int = 64):
+    """The edges (p1, p2, length) of a minimum spanning tree of the
+    complete graph on the rows of coords, by dual-tree Boruvka over a
+    KD-tree: sub-quadratic for low-dimensional points.
+    """
+    X = np.asarray(coords)
+    if X.shape[0] < 2:
+        return sorted_edges(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0))
+    tree = KDTree(X, leaf_size)
+    lo, hi, length = _Boruvka(tree).run()
+    return sorted_edges(tree.index[lo], tree.index[hi], length)
+
+
+def boruvka_link(coords, p1, p2, leaf_size: int = 64):
+    """The edges (p1, p2, length) joining the trees of the forest with
+    edges (p1, p2) on the rows of coords into a minimum spanning tree of
+    the complete graph, if the forest is part of one: dual-tree Boruvka
+    (see boruvka_mst) starting from the trees of the forest.
+    """
+    X = np.asarray(coords)
+    tree = KDTree(X, leaf_size)
+    pos = np.empty(len(X), dtype=np.int64)
+    pos[tree.index] = np.arange(len(X))
+    comp = connected_components(len(X), pos[np.asarray(p1, dtype=np.int64)], pos[np.asarray(p2, dtype=np.int64)])
+    lo, hi, length = _Boruvka(tree, comp).run()
+    return sorted_edges(tree.index[lo], tree.index[hi], length)
+
+
+def _pair_mst(X: np.ndarray, idx: np.ndarray):
+    """The edges of a minimum spanning tree of the points idx of X."""
+    p1, p2, length = prim_mst(X[idx])
+    return idx[p1], idx[p2], length
+
+
+def _worker_pair_mst(idx: np.ndarray):
+    return _pair_mst(worker_array('X'), idx)
+
+
+def parallel_mst(coords, workers: int = 0, parts: int = None):
+    """The edges (p1, p2, length) of a graph containing a minimum
+    spanning tree of the complete graph on the rows of coords, computed
+    by workers processes (0 for all the CPUs).
+
+    The points are split into parts blocks, and each pair of blocks gets
+    a minimum spanning tree by prim_mst.  An edge left out of the tree of
+    its pair closes a cycle of no longer edges, so the union of these
+    trees (about parts * n edges) holds a minimum spanning tree of the
+    whole cloud, which Dendrogram.build then finds by Kruskal.  The
+    pairs cost about twice a single prim_mst in total, split between
+    the workers, so a single worker runs prim_mst directly unless parts
+    is given.
+    """
+    X = np.asarray(coords)
+    n = X.shape[0]
+    workers = worker_count(workers)
+    if workers == 1 and parts is None:  # The pairs would only double the work
+        return prim_mst(X)
+    if parts is None:  # Enough pairs to keep the workers busy
+        parts = 2
+        while parts * (parts - 1) // 2 < 2 * workers:
+            parts += 1
+    parts = min(parts, n)
+    if parts < 2:
+        return prim_mst(X)
+    blocks = np.array_split(np.arange(n), parts)
+    pairs = [np.concatenate((blocks[a], blocks[b]))
+             for a in range(parts) for b in range(a + 1, parts)]
+    if workers == 1:
+        trees = [_pair_mst(X, idx) for idx in pairs]
+    else:
+        with shared_pool(workers, {'X': X}) as (pool, _):
+            trees = list(pool.map(_worker_pair_mst, pairs))
+    p1, p2, length = (np.concatenate(a) for a in zip(*trees))
+    p1, p2 = np.maximum(p1, p2), np.minimum(p1, p2)
+    # The edges inside a block are found by each of its pairs
+    _, first = np.unique(p1 * n + p2, return_index=True)
+    return sorted_edges(p1[first], p2[first], length[first])
+
+
+def knn_graph_edges(coords, k: int = 10):
+    """The sorted edges of the approximate k-nearest-neighbour graph of
+    coords, repaired to be connected (see TD.knn): about k * n edges,
+    whose minimum spanning tree has nearly minimal heights for
+    high-dimensional clouds.
+    """
+    return sorted_edges(*knn_edges(coords, k))
+
+
+# The sorted edges of a connected graph on the rows of coords, for
+# Dendrogram.build: exactly a minimum spanning tree for 'prim' and
+# 'boruvka', a superset of one for 'parallel', an approximation for 'knn'.
+_MST_METHODS = {
+    'prim': prim_mst,
+    'boruvka': boruvka_mst,
+    'parallel': parallel_mst,
+    'knn': knn_graph_edges,
+}
+
+
+def mst_graph(c: Cloud, method: str = 'prim', workers: int = None) -> ArrayGraph:
+    """The graph of the points of c restricted to the edges of a
+    minimum spanning tree, computed with the given method (or, for
+    'parallel', to a few times n edges including such a tree, and for
+    'knn', to the k-NN graph including an approximation of it).
+
+    workers is the number of processes for 'parallel' (by default all
+    the CPUs).
+    """
+    if method not in _MST_METHODS:
+        raise ValueError(f'Unknown MST method {method!r}; expected one of {", ".join(_MST_METHODS)}')
+    g = ArrayGraph()
+    g.add_nodes(c.names)
+    if method == 'parallel' and workers is not None:
+        g._set_edge_arrays(*parallel_mst(c.coords, workers))
+    else:
+        g._set_edge_arrays(*_MST_METHODS[method](c.coords))
+    return g
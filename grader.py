@@ -1,13 +1,26 @@
 #! /usr/bin/env python3
+import io
+import os
 import sys
+import tempfile
 import unittest
+import unittest.mock
 import numpy as np
+try:
+    import scipy.cluster.hierarchy as sch
+except ImportError:
+    sch = None
 
 from itertools import permutations
 
 from TD.cloud import *
 from TD.graph import *
 from TD.dendrogram import *
+from TD.distance import condensed_size, condensed_distances, band_distances, parallel_condensed_distances
+from TD.mst import parallel_mst, prim_mst
+from TD.external import *
+from TD.linkage import nn_chain_linkage
+from TD.knn import knn_neighbours, knn_edges
 
 
 """
@@ -85,6 +98,22 @@ class Grader(unittest.TestCase):
         self.assertEqual(len(g.edges), 2)
         self.assertEqual(g.edges, [e_2, e_1], msg="edges not sorted")
 
+    def test_unsorted_edges(self):
+        for g in [Graph(), ArrayGraph()]:
+            g.add_nodes(['a', 'b', 'c'])
+            g.edges = [Edge(1, 0, 5.0), Edge(2, 1, 1.0), Edge(2, 0, 2.0)]
+            self.assertEqual([e.length for e in g.edges], [1.0, 2.0, 5.0], msg=type(g).__name__)
+            d = Dendrogram(g)
+            d.build()
+            self.assertEqual(sorted(d.height), [-1, 0.5, 1.0], msg=type(g).__name__)
+        g = Graph()
+        g.add_nodes(['a', 'b', 'c'])
+        for e in [Edge(1, 0, 5.0), Edge(2, 1, 1.0), Edge(2, 0, 2.0)]:
+            g.edges.append(e)
+        d = Dendrogram(g)
+        d.build()
+        self.assertEqual(sorted(d.height), [-1, 0.5, 1.0])
+
     def test_graph_from_cloud(self):
         c = Cloud()
         c.add_point(Point([1.0, 0.0, 0.0], 'x'))
@@ -118,6 +147,17 @@ class Grader(unittest.TestCase):
         self.assertEqual(g.edges[2].p2, 1)
         self.assertAlmostEqual(g.edges[2].length, 3)
 
+    def test_graph_from_matrix_forms(self):
+        nodes = ['A', 'B', 'C']
+        full = [[0, 1, 2], [1, 0, 3], [2, 3, 0]]
+        for lengths in [[[0], [1, 0], [2, 3, 0]], np.array(full, dtype=float), [[], [1], [2, 3]]]:
+            g = graph_from_matrix(nodes, lengths)
+            self.assertEqual([(e.p1, e.p2, e.length) for e in g.edges], [(1, 0, 1), (2, 0, 2), (2, 1, 3)])
+        self.assertEqual(len(graph_from_matrix(['A'], [[0]]).edges), 0)
+        for lengths in [[[0], [1], [2]], [[0], [1, 0]]]:  # A short row, a missing row
+            with self.assertRaises(ValueError):
+                graph_from_matrix(nodes, lengths)
+
     def test_graph_from_matrix_file(self):
         filename = 'csv/languages.csv'
         message = "Graph from csv/languages.csv"
@@ -141,6 +181,31 @@ class Grader(unittest.TestCase):
         self.assertEqual(g.edges[-1].p2, 9, msg=message)
         self.assertAlmostEqual(g.edges[-1].length, 51.0, msg=message)
 
+    def test_condensed_file(self):
+        with open('csv/iris.csv', 'r') as infile:
+            c = load_cloud_from_file(infile)
+        lengths = condensed_distances(c.coords)
+        self.assertTrue(np.array_equal(band_distances(c.coords, 40, 90),
+                                       lengths[condensed_size(40):condensed_size(90)]))
+        g = graph_from_cloud(c)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'iris.condensed')
+            save_condensed(filename, c.names, lengths)
+            self.assertTrue(is_condensed_file(filename))
+            self.assertFalse(is_condensed_file('csv/iris.csv'))
+            names, lengths_2 = open_condensed(filename)
+            self.assertEqual(list(names), c.names)
+            self.assertIsInstance(lengths_2, np.memmap)
+            self.assertTrue(np.array_equal(lengths_2, lengths))
+            g_2 = graph_from_matrix_file(filename)  # Detected by its magic bytes
+            self.assertEqual(list(g_2.node_names), c.names)
+            for a, b in zip(g_2.edge_arrays(), g.edge_arrays()):
+                self.assertTrue(np.array_equal(a, b))
+            with self.assertRaises(ValueError):
+                save_condensed(filename, c.names[:-1], lengths)
+            with self.assertRaises(ValueError):
+                open_condensed('csv/iris.csv')
+
     def test_find_rep(self):
         g = Graph()
         g.add_nodes(['A', 'B', 'C', 'D', 'E'])
@@ -236,6 +301,335 @@ class Grader(unittest.TestCase):
         gch_test(2.0, [0, 0, 0, 1.0, 0])
         gch_test(2.5, [0, 0, 0, 2.5, 0])
 
+    def test_cloud_coords(self):
+        c = Cloud()
+        for i in range(10):
+            c.add_point(Point([i, -i], name=str(i)))
+        self.assertEqual(len(c), 10)
+        self.assertEqual(c.coords.shape, (10, 2))
+        self.assertEqual(c.names, [str(i) for i in range(10)])
+        self.assertEqual(c[3].name, '3')
+        np.testing.assert_array_equal(c[3].coords, [3.0, -3.0])
+        np.testing.assert_array_equal(c[-1].coords, [9.0, -9.0])
+        self.assertEqual([p.name for p in c], c.names)
+        with self.assertRaises(ValueError):
+            c.add_point(Point([1.0, 2.0, 3.0]))
+        c = Cloud.from_coords(np.array([[1, 2], [3, 4]]))
+        c.add_point(Point([0.5, 0.7]))
+        self.assertEqual(c.coords.dtype, np.float64)
+        self.assertEqual(c.coords.tolist(), [[1.0, 2.0], [3.0, 4.0], [0.5, 0.7]])
+        X = np.zeros((3, 2), dtype=np.float32)
+        self.assertIs(Cloud.from_coords(X).coords.base, X)  # Not copied
+
+    def test_load_cloud_options(self):
+        with open('csv/iris.csv', 'r') as infile:
+            c = load_cloud_from_file(infile)
+        with open('csv/iris.csv', 'r') as infile:
+            c_2 = load_cloud_from_file(infile, usecols=[0, 2], dtype=np.float32, max_rows=40, chunk_rows=16)
+        self.assertEqual(len(c_2), 40)
+        self.assertEqual(c_2.coords.dtype, np.float32)
+        np.testing.assert_array_equal(c_2.coords, c.coords[:40, [0, 2]].astype(np.float32))
+        self.assertEqual(c_2.names, c.names[:40])
+        with open('csv/iris.csv', 'r') as infile:
+            c_3 = load_cloud_from_file(io.StringIO(infile.read()), chunk_rows=7)
+        np.testing.assert_array_equal(c_3.coords, c.coords)
+        self.assertEqual(c_3.names, c.names)
+
+    def test_cloud_file(self):
+        with open('csv/iris.csv', 'r') as infile:
+            c = load_cloud_from_file(infile)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'iris.cloud')
+            save_cloud(c, filename)
+            self.assertTrue(is_cloud_file(filename))
+            self.assertFalse(is_cloud_file('csv/iris.csv'))
+            c_2 = open_cloud(filename)
+            self.assertIsInstance(c_2.coords, np.memmap)
+            np.testing.assert_array_equal(c_2.coords, c.coords)
+            self.assertEqual(list(c_2.names), c.names)
+            self.assertEqual(c_2[7].name, c[7].name)
+            c_2.add_point(Point([1.0, 2.0, 3.0, 4.0], 'new'))
+            self.assertEqual(len(c_2), 151)
+            np.testing.assert_array_equal(c_2.coords[:150], c.coords)
+            self.assertEqual(c_2[150].name, 'new')
+            np.testing.assert_array_equal(open_cloud(filename).coords, c.coords)  # File unchanged
+            empty = os.path.join(tmp, 'empty.cloud')
+            save_cloud(Cloud(), empty)
+            c_3 = open_cloud(empty)
+            self.assertEqual(len(c_3), 0)
+            c_3.add_point(Point([1.0, 2.0], 'a'))
+            self.assertEqual(c_3.coords.tolist(), [[1.0, 2.0]])
+            with self.assertRaises(ValueError):
+                open_cloud('csv/iris.csv')
+
+    def test_bulk_add_edges(self):
+        for g in (Graph(), ArrayGraph()):
+            g.add_edges([Edge(0, 1, 2.0), Edge(1, 2, 1.0)])
+            g.bulk_add_edges([Edge(2, 3, 2.0), Edge(3, 4, 0.5)])
+            g.bulk_add_edges([Edge(4, 5, 1.0)])
+            g.add_edges([Edge(5, 6, 2.0), Edge(6, 7, 0.0)])
+            self.assertEqual([(e.p1, e.p2) for e in g.edges],
+                             [(6, 7), (3, 4), (1, 2), (4, 5), (0, 1), (2, 3), (5, 6)],
+                             msg=type(g).__name__)
+
+    def test_from_cloud(self):
+        for filename in ['csv/test6.csv', 'csv/bluered.csv', 'csv/iris.csv']:
+            with open(filename, 'r') as infile:
+                c = load_cloud_from_file(infile)
+            d = Dendrogram(graph_from_cloud(c))
+            d.build()
+            for method in ['kruskal', 'lazy', 'prim', 'boruvka', 'parallel']:
+                d_m = Dendrogram.from_cloud(c, method=method)
+                self.assertEqual(sorted(d_m.height), sorted(d.height),
+                                 msg=f"{filename}, {method=}")
+
+    def test_cut_many(self):
+        d = make_example()
+        labels, total, ns = d.cut_many([1, 0.1, 0.5, 2.5])
+        self.assertEqual(labels.tolist(), [[3, 3, 3, 3, 4], [0, 1, 2, 3, 4],
+                                           [1, 1, 3, 3, 4], [3, 3, 3, 3, 3]])
+        self.assertEqual(total.tolist(), [2, 5, 3, 1])
+        self.assertEqual(ns.tolist(), [1, 0, 2, 1])
+        for h, t, s in zip([1, 0.1, 0.5, 2.5], total, ns):
+            self.assertEqual(d.num_clusters_at(h), t, msg=f"cut height = {h}")
+            self.assertEqual(d.num_ns_clusters_at(h), s, msg=f"cut height = {h}")
+
+    def test_cluster_index(self):
+        for height, refs in [(0.1, [0, 0, 0, 0, 0]), (0.5, [0, 0.5, 0, 0.5, 0]),
+                             (2.0, [0, 0, 0, 1.0, 0]), (2.5, [0, 0, 0, 2.5, 0])]:
+            d = make_example()
+            d.set_clusters(height, index=True)
+            for i in range(5):
+                self.assertAlmostEqual(d.get_cluster_height(i), refs[i],
+                                       msg=f"Example with cut height = {height}")
+        d = make_example()
+        d.set_clusters(0.5)
+        self.assertEqual(d.get_members(1).tolist(), [0, 1])
+        self.assertEqual(d.get_members(3).tolist(), [2, 3])
+        self.assertEqual(d.get_members(0).tolist(), [])
+        self.assertEqual([d.cluster_size(i) for i in range(5)], [0, 2, 0, 2, 1])
+
+    def test_save_load(self):
+        d = make_example()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'example.npz')
+            d.save(filename)
+            d_2 = Dendrogram.load(filename)
+        self.assertEqual(d_2.get_n(), 5)
+        for attr in ['parent', 'rank', 'left', 'down', 'height']:
+            self.assertEqual(getattr(d_2, attr), getattr(d, attr), msg=attr)
+        d_2.set_clusters(0.5)
+        self.assertEqual(d_2.cluster, [1, 1, 3, 3, 4])
+
+    def test_dendrogram_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'test6.csv')
+            with open('csv/test6.csv', 'r') as infile, open(filename, 'w') as outfile:
+                outfile.write(infile.read())
+            cache_dir = os.path.join(tmp, 'cache')
+            d = dendrogram_from_file(filename, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            with unittest.mock.patch.object(Dendrogram, 'from_cloud', side_effect=AssertionError('rebuilt')):
+                d_2 = dendrogram_from_file(filename, cache_dir=cache_dir)  # Cache hit
+            self.assertEqual(d_2.parent, d.parent)
+            self.assertEqual(d_2.height, d.height)
+            dendrogram_from_file(filename, method='boruvka', cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            with open(filename, 'a') as outfile:
+                outfile.write('9.0,9.0,far\n')
+            d_3 = dendrogram_from_file(filename, cache_dir=cache_dir)  # Changed file
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+            self.assertEqual(d_3.get_n(), d.get_n() + 1)
+            for entry in os.listdir(cache_dir):  # Interrupted writes
+                with open(os.path.join(cache_dir, entry), 'r+b') as f:
+                    f.truncate(100)
+            d_4 = dendrogram_from_file(filename, cache_dir=cache_dir)
+            self.assertEqual(d_4.height, d_3.height)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)  # Replaced, no temporary file left
+            with unittest.mock.patch.object(Dendrogram, 'from_cloud', side_effect=AssertionError('rebuilt')):
+                self.assertEqual(dendrogram_from_file(filename, cache_dir=cache_dir).height, d_3.height)
+
+    def test_parallel_distances(self):
+        X = np.random.default_rng(0).normal(size=(300, 3))
+        D = condensed_distances(X, block_size=32)
+        self.assertTrue(np.array_equal(condensed_distances(X, block_size=32, workers=3), D))
+        with tempfile.TemporaryDirectory() as tmp:
+            out = np.memmap(os.path.join(tmp, 'distances'), dtype=np.float64, mode='w+',
+                            shape=D.shape)
+            parallel_condensed_distances(X, block_size=32, out=out, workers=2)
+            self.assertTrue(np.array_equal(out, D))
+            del out
+        out = np.empty(D.shape)
+        self.assertIs(parallel_condensed_distances(X, block_size=32, out=out, workers=2), out)
+        self.assertTrue(np.array_equal(out, D))
+        c = Cloud.from_coords(X)
+        self.assertTrue(np.array_equal(graph_from_cloud(c, workers=2).edge_arrays()[2],
+                                       graph_from_cloud(c).edge_arrays()[2]))
+
+    def test_parallel_mst(self):
+        X = np.random.default_rng(0).integers(0, 5, size=(200, 2)).astype(float)  # Many ties
+        c = Cloud.from_coords(X, [str(i) for i in range(200)])
+        heights = sorted(Dendrogram.from_cloud(c, method='kruskal').height)
+        for workers, parts in [(1, 5), (2, 3), (3, None)]:
+            g = Graph()
+            g.add_nodes(c.names)
+            g.add_edges([Edge(*e) for e in zip(*(a.tolist() for a in parallel_mst(X, workers, parts)))])
+            d = Dendrogram(g)
+            d.build()
+            self.assertEqual(sorted(d.height), heights, msg=f"{workers=}, {parts=}")
+        for a, b in zip(parallel_mst(X, 1), prim_mst(X)):
+            self.assertTrue(np.array_equal(a, b))
+        with unittest.mock.patch('TD.mst.shared_pool', side_effect=AssertionError('pool started')):
+            d = Dendrogram.from_cloud(c, method='parallel', workers=1)
+        self.assertEqual(sorted(d.height), heights)
+
+    def test_external(self):
+        with open('csv/iris.csv', 'r') as infile:
+            c = load_cloud_from_file(infile)
+        g = graph_from_cloud(c)
+        d = Dendrogram(g)
+        d.build()
+        with tempfile.TemporaryDirectory() as tmp:
+            for budget in [1 << 12, 1 << 16, 1 << 30]:  # Many runs, a few runs, in memory
+                edges = list(sort_edge_chunks(cloud_edges(c, 100), len(c), budget, tmp))
+                for a, b in zip(g.edge_arrays(), (np.concatenate(a) for a in zip(*edges))):
+                    self.assertTrue(np.array_equal(a, b), msg=f"{budget=}")
+                d_ext = external_dendrogram_from_cloud(c, budget, tmp)
+                self.assertEqual(d_ext.parent, d.parent, msg=f"{budget=}")
+                self.assertEqual(d_ext.height, d.height, msg=f"{budget=}")
+                self.assertEqual(os.listdir(tmp), [])
+            d = Dendrogram(graph_from_matrix_file('csv/languages.csv'))
+            d.build()
+            d_ext = external_dendrogram_from_matrix_file('csv/languages.csv', 1 << 10, tmp)
+            self.assertEqual(d_ext.height, d.height)
+            # More edges than build reads at once
+            c = Cloud.from_coords(np.random.default_rng(0).random((400, 2)))
+            d = Dendrogram.from_cloud(c, method='kruskal')
+            self.assertEqual(d.height, external_dendrogram_from_cloud(c, 1 << 20, tmp).height)
+            self.assertEqual(sorted(d.height), sorted(Dendrogram.from_cloud(c).height))
+
+    def test_lazy_condensed_edges(self):
+        X = np.random.default_rng(0).integers(0, 4, size=(100, 2)).astype(float)  # Many ties
+        lengths = condensed_distances(X)
+        g = graph_from_condensed([str(i) for i in range(100)], lengths)
+        for first in [1, 100, 10000]:
+            chunks = list(lazy_condensed_edges(lengths, first))
+            for a, b in zip(g.edge_arrays(), (np.concatenate(a) for a in zip(*chunks))):
+                self.assertTrue(np.array_equal(a, b), msg=f"{first=}")
+
+    def test_insert_points(self):
+        X = np.random.default_rng(0).integers(0, 6, size=(120, 2)).astype(float)  # Many ties
+        names = [str(i) for i in range(120)]
+        d = Dendrogram.from_cloud(Cloud.from_coords(X[:100], names[:100]))
+        d.insert_point(Point(X[100], names[100]))
+        d.insert_points(X[101:], names[101:])
+        d_ref = Dendrogram.from_cloud(Cloud.from_coords(X, names), method='kruskal')
+        self.assertEqual(list(d.g.node_names), names)
+        self.assertEqual(sorted(d.height), sorted(d_ref.height))
+        self.assertEqual(d.g.edge_count(), 119)
+        with self.assertRaises(ValueError):
+            make_example().insert_points(X[:1])
+
+    def test_remove_points(self):
+        rng = np.random.default_rng(0)
+        X = rng.integers(0, 6, size=(120, 2)).astype(float)  # Many ties
+        names = [str(i) for i in range(120)]
+        X_0 = X.copy()
+        d = Dendrogram.from_cloud(Cloud.from_coords(X, names))
+        point = d.cloud[10]
+        d.remove_point(7)
+        self.assertTrue(np.array_equal(X, X_0))  # The caller's array is not compacted
+        self.assertEqual(point.coords.tolist(), X[10].tolist())
+        removed = [7] + rng.choice(np.arange(8, 120), size=15, replace=False).tolist()
+        d.remove_points([i - 1 for i in removed[1:]])
+        kept = [i for i in range(120) if i not in removed]
+        d_ref = Dendrogram.from_cloud(Cloud.from_coords(X[kept], [names[i] for i in kept]),
+                                      method='kruskal')
+        self.assertEqual(list(d.g.node_names), [names[i] for i in kept])
+        self.assertEqual(sorted(d.height), sorted(d_ref.height))
+        # Removing the bridge between two clusters
+        X = np.concatenate([rng.normal(size=(100, 2)), 50 + rng.normal(size=(100, 2)), [[25.0, 25.0]]])
+        d = Dendrogram.from_cloud(Cloud.from_coords(X))
+        d.remove_point(200)
+        self.assertEqual(sorted(d.height), sorted(Dendrogram.from_cloud(Cloud.from_coords(X[:200])).height))
+
+    def test_window(self):
+        X = np.random.default_rng(0).random((200, 2))
+        names = [str(i) for i in range(200)]
+        X_0 = X.copy()
+        d = Dendrogram.from_cloud(Cloud.from_coords(X[:50], names[:50]))
+        d.window = 50
+        for start in range(50, 200, 30):
+            d.insert_points(X[start:start + 30], names[start:start + 30])
+            self.assertTrue(np.array_equal(X, X_0), msg=f"{start=}")
+            end = min(start + 30, 200)
+            self.assertEqual(list(d.g.node_names), names[end - 50:end])
+            d_ref = Dendrogram.from_cloud(Cloud.from_coords(X[end - 50:end]), method='kruskal')
+            self.assertEqual(sorted(d.height), sorted(d_ref.height), msg=f"{start=}")
+
+    def test_find_heights(self):
+        d = make_example()
+        for eps, heights in [(1, [1.0, 2.5]), (0.25, [0.5, 1.0, 2.5]), (1e-12, [0.5, 1.0, 2.5]),
+                             (1e-20, [0.5, 1.0, 2.5]), (1e-320, [0.5, 1.0, 2.5])]:
+            d.find_heights(eps)
+            self.assertEqual(d.significant_heights, heights, msg=f"{eps=}")
+        self.assertEqual(d.largest_gaps(1), [1.0])
+        self.assertEqual(d.largest_gaps(5), [1.0, 0.5])
+
+    def test_knn(self):
+        rng = np.random.default_rng(0)
+        X = np.concatenate([rng.normal(size=(40, 16)), 100 + rng.normal(size=(40, 16))])
+        D = np.sqrt(np.sum((X[:, None] - X[None]) ** 2, axis=-1))
+        np.fill_diagonal(D, np.inf)
+        nbr, dist = knn_neighbours(X, 79)
+        self.assertTrue(np.array_equal(np.sort(nbr, axis=1), np.sort(np.argsort(D, axis=1)[:, :79], axis=1)))
+        p1, p2, _ = knn_edges(X, 3)  # The two blobs are only linked by the repair
+        self.assertEqual(len(set(connected_components(80, p1, p2).tolist())), 1)
+        X_tight = (rng.uniform(0, 100, size=(50, 1, 8)) + 0.01 * rng.normal(size=(50, 4, 8))).reshape(200, 8)
+        p1, p2, _ = knn_edges(X_tight, 3)  # 50 components to link
+        self.assertEqual(len(set(connected_components(200, p1, p2).tolist())), 1)
+        self.assertEqual([len(a) for a in knn_edges(np.zeros((1, 4)))], [0, 0, 0])
+        c = Cloud.from_coords(X, [str(i) for i in range(80)])
+        heights = np.sort(Dendrogram.from_cloud(c, method='prim').height)
+        d = Dendrogram.from_cloud(c, method='knn')
+        self.assertEqual(len(d.height), len(heights))
+        self.assertTrue(np.all(np.sort(d.height) >= heights))  # Holds for any spanning tree
+        self.assertLess(np.max(np.sort(d.height) / np.maximum(heights, 1e-12)), 1.1)
+
+    @unittest.skipUnless(sch, 'scipy is not installed')
+    def test_linkage(self):
+        for filename in ['test6', 'bluered', 'iris']:
+            with open(os.path.join('csv', filename + '.csv'), 'r') as infile:
+                c = load_cloud_from_file(infile)
+            d = Dendrogram.from_cloud(c)
+            Z = d.to_linkage()
+            Z_ref = sch.linkage(c.coords, 'single')
+            self.assertTrue(sch.is_valid_linkage(Z), msg=filename)
+            np.testing.assert_allclose(Z[:, 2], Z_ref[:, 2], err_msg=filename)
+            np.testing.assert_allclose(sch.cophenet(Z), sch.cophenet(Z_ref), err_msg=filename)
+            d_2 = Dendrogram.from_linkage(Z_ref, c.names)
+            np.testing.assert_allclose(sorted(d_2.height), sorted(d.height), err_msg=filename)
+            np.testing.assert_allclose(sch.cophenet(d_2.to_linkage()), sch.cophenet(Z_ref),
+                                       err_msg=filename)
+
+    @unittest.skipUnless(sch, 'scipy is not installed')
+    def test_other_linkages(self):
+        for filename in ['test6', 'bluered', 'iris']:
+            with open(os.path.join('csv', filename + '.csv'), 'r') as infile:
+                c = load_cloud_from_file(infile)
+            for method in ['complete', 'average', 'ward']:
+                msg = f"{filename}, {method}"
+                Z_ref = sch.linkage(c.coords, method)
+                Z = nn_chain_linkage(condensed_distances(c.coords), method)
+                np.testing.assert_allclose(Z, Z_ref, err_msg=msg)
+                d = Dendrogram.from_cloud(c, linkage=method)
+                np.testing.assert_allclose(sch.cophenet(d.to_linkage()), sch.cophenet(Z_ref), err_msg=msg)
+                for h in Z_ref[::10, 2] / 2:
+                    d.set_clusters(h)
+                    labels = sch.fcluster(Z_ref, 2 * h, 'distance')
+                    self.assertEqual(d.total_clusters, labels.max(), msg=msg)
+                    self.assertEqual(len(set(d.cluster)), labels.max(), msg=msg)
+
 
 def suite(test_nb):
     suite = unittest.TestSuite()
@@ -253,11 +647,37 @@ def suite(test_nb):
         "test_count_ns_clusters",
         "test_get_cluster_height"
     ]
+    # Not graded (see the annotation above): only run by ./grader.py 0
+    extra_test_name = [
+        "test_cloud_coords",
+        "test_bulk_add_edges",
+        "test_from_cloud",
+        "test_cut_many",
+        "test_cluster_index",
+        "test_save_load",
+        "test_linkage",
+        "test_other_linkages",
+        "test_parallel_distances",
+        "test_parallel_mst",
+        "test_external",
+        "test_lazy_condensed_edges",
+        "test_insert_points",
+        "test_remove_points",
+        "test_window",
+        "test_find_heights",
+        "test_knn",
+        "test_unsorted_edges",
+        "test_graph_from_matrix_forms",
+        "test_load_cloud_options",
+        "test_cloud_file",
+        "test_condensed_file",
+        "test_dendrogram_cache",
+    ]
 
     if test_nb > 0:
         suite.addTest(Grader(test_name[test_nb - 1]))
     else:
-        for name in test_name:
+        for name in test_name + extra_test_name:
             suite.addTest(Grader(name))
 
     return suite